@@ -0,0 +1,91 @@
+"""
+OpenAPI schema of the API and the documentation pages showing it.
+
+Introspecting every view is expensive: the schema is written to SCHEMA_ROOT by the `generate_schema` command at build
+time and served from there, as a static file for the Swagger and redoc pages. In DEBUG it is generated in memory
+instead, again only when the URLconf changed.
+
+drf_yasg is only imported by the workers serving the documentation.
+"""
+import functools
+import os
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import get_resolver
+from rest_framework import permissions
+
+# Schema files of SCHEMA_ROOT, with their content type, by extension
+SCHEMA_FILES = {
+    '.json': ('swagger.json', 'application/json'),
+    '.yaml': ('swagger.yaml', 'application/yaml'),
+}
+# Encoded schemas, with the URL resolver they were generated from
+_schemas = {}
+
+
+def info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="My24h Api",
+        default_version='v1',
+        description="",
+        contact=openapi.Contact(email="courses@24heures.org"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def generate_schema():
+    """Introspect the API views. The schema has no host, which clients take from the serving one."""
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    return OpenAPISchemaGenerator(info()).get_schema(request=None, public=True)
+
+
+def encode_schema(schema, extension):
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+    codec = OpenAPICodecJson if extension == '.json' else OpenAPICodecYaml
+    return codec(validators=[]).encode(schema)
+
+
+def get_schema(extension):
+    """Return the encoded schema, read from SCHEMA_ROOT unless in DEBUG or it was not generated."""
+    resolver = get_resolver()
+    cached = _schemas.get(extension)
+    if cached is not None and (not settings.DEBUG or cached[0] is resolver):
+        return cached[1]
+    path = os.path.join(settings.SCHEMA_ROOT, SCHEMA_FILES[extension][0])
+    if not settings.DEBUG and os.path.exists(path):
+        with open(path, 'rb') as file:
+            content = file.read()
+    else:
+        content = encode_schema(generate_schema(), extension)
+    _schemas[extension] = (resolver, content)
+    return content
+
+
+def schema(request, format):
+    return HttpResponse(get_schema(format), content_type=SCHEMA_FILES[format][1])
+
+
+@functools.lru_cache(maxsize=None)
+def schema_view():
+    from drf_yasg.views import get_schema_view
+
+    return get_schema_view(info(), public=True, permission_classes=[permissions.AllowAny])
+
+
+def documentation(renderer):
+    """View of the Swagger or redoc page, which loads the schema from SWAGGER_SETTINGS/REDOC_SETTINGS['SPEC_URL']."""
+    @functools.lru_cache(maxsize=None)
+    def get_view():
+        return schema_view().with_ui(renderer, cache_timeout=0)
+
+    def view(request, *args, **kwargs):
+        if request.GET.get('format') == 'openapi':
+            return schema(request, '.json')
+        return get_view()(request, *args, **kwargs)
+    view.csrf_exempt = True
+    return view
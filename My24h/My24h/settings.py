@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.RankingSnapshotMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,10 +83,54 @@ DATABASES = {
         "USER": os.getenv("SQL_USER", default="user"),
         "PASSWORD": os.getenv("SQL_PASSWORD", default="password"),
         "HOST": os.getenv("SQL_HOST", default="localhost"),
-        "PORT": os.getenv("SQL_PORT", default="5432")
+        "PORT": os.getenv("SQL_PORT", default="5432"),
+        # Seconds a connection is reused across requests, "none" to keep it open forever.
+        "CONN_MAX_AGE": None if os.getenv("SQL_CONN_MAX_AGE") == "none"
+        else int(os.getenv("SQL_CONN_MAX_AGE", default=60)),
+        # Ping reused connections before their first query of each request. Django < 4.1 only supports it with the
+        # api.db.mysql engine.
+        "CONN_HEALTH_CHECKS": bool(int(os.getenv("SQL_CONN_HEALTH_CHECKS", default=1))),
     }
 }
 
+# With the api.db.mysql engine, SQL_POOL_MAX_SIZE > 0 shares a pool of connections between the threads of each process
+# (ASGI or threaded workers) instead of keeping one connection per thread. Connections are opened on demand, and
+# SQL_POOL_MIN_SIZE idle ones are kept open past SQL_POOL_MAX_IDLE seconds.
+if int(os.getenv("SQL_POOL_MAX_SIZE", default=0)) > 0:
+    DATABASES['default']['POOL'] = {
+        'MIN_SIZE': int(os.getenv("SQL_POOL_MIN_SIZE", default=2)),
+        'MAX_SIZE': int(os.getenv("SQL_POOL_MAX_SIZE")),
+        'TIMEOUT': int(os.getenv("SQL_POOL_TIMEOUT", default=10)),
+        'MAX_IDLE': int(os.getenv("SQL_POOL_MAX_IDLE", default=300)),
+    }
+    # Connections go back to the pool at the end of every request.
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# Each process has its own local memory cache: set REDIS_URL (and install redis) to share it between workers.
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
+        }
+    }
+
+# Seconds during which categories and races responses are cached, unless they are modified before
+REFERENCE_CACHE_TIMEOUT = int(os.getenv("REFERENCE_CACHE_TIMEOUT", default=300))
+
+# Seconds during which a leaderboard snapshot is served before being recomputed, unless points are credited before
+RANKING_SNAPSHOT_TTL = int(os.getenv("RANKING_SNAPSHOT_TTL", default=10))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -122,9 +167,19 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = '/static/'
-#
-# MEDIA_URL = '/mediafiles'
-# MEDIA_ROOT = os.path.join(BASE_DIR, "mediafiles")
+
+# OpenAPI schema written by the generate_schema command, and collected with the static files
+SCHEMA_ROOT = os.path.join(BASE_DIR, 'schema')
+STATICFILES_DIRS = [SCHEMA_ROOT]
+
+MEDIA_URL = os.getenv("MEDIA_URL", default='/media/')
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", default='/media/')
+
+# Uploaded pictures limits, in bytes and pixels
+PICTURE_MAX_SIZE = int(os.getenv("PICTURE_MAX_SIZE", default=5 * 1024 * 1024))
+PICTURE_MAX_PIXELS = int(os.getenv("PICTURE_MAX_PIXELS", default=24_000_000))
+# Side, in pixels, of the square thumbnails of the athletes and teams pictures
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", default=128))
 
 EMAIL_BACKEND = os.getenv("EMAIL_BACKEND")
 EMAIL_HOST = os.getenv("EMAIL_HOST")
@@ -140,16 +195,46 @@ EMAIL_USE_SSL = int(os.getenv("EMAIL_USE_SSL", default=1))
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.OptInCursorPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ]
 }
 
+STRAVA_CLIENT_ID = os.getenv("CLIENT_ID")
+STRAVA_CLIENT_SECRET = os.getenv("CLIENT_SECRET")
+STRAVA_API_URL = os.getenv("STRAVA_API_URL", default="https://www.strava.com/api/v3")
+STRAVA_OAUTH_URL = os.getenv("STRAVA_OAUTH_URL", default="https://www.strava.com/oauth/token")
+# Epochs of the activities synchronized for athletes whose race has no start date
+STRAVA_ACTIVITIES_AFTER = int(os.getenv("STRAVA_ACTIVITIES_AFTER", default=1618401600))
+STRAVA_ACTIVITIES_BEFORE = int(os.getenv("STRAVA_ACTIVITIES_BEFORE", default=1619179200))
+# Seconds after which an athlete's Strava activities are synchronized again
+STRAVA_SYNC_INTERVAL = int(os.getenv("STRAVA_SYNC_INTERVAL", default=300))
+# Seconds after which a running synchronization job is considered lost and queued again
+STRAVA_SYNC_JOB_TIMEOUT = int(os.getenv("STRAVA_SYNC_JOB_TIMEOUT", default=600))
+# Seconds before a failed job is first retried, doubled after each failure, and attempts after which it is given up
+STRAVA_SYNC_RETRY_DELAY = int(os.getenv("STRAVA_SYNC_RETRY_DELAY", default=60))
+STRAVA_SYNC_MAX_ATTEMPTS = int(os.getenv("STRAVA_SYNC_MAX_ATTEMPTS", default=8))
+STRAVA_SYNC_WORKERS = int(os.getenv("STRAVA_SYNC_WORKERS", default=8))
+# Seconds before the promotion watermark scanned again, longer than the Strava activities ingestion transactions
+STRAVA_PROMOTION_OVERLAP = int(os.getenv("STRAVA_PROMOTION_OVERLAP", default=300))
+# Minutes before their expiration at which Strava access tokens are refreshed
+STRAVA_TOKEN_REFRESH_MARGIN = int(os.getenv("STRAVA_TOKEN_REFRESH_MARGIN", default=30))
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN")
+# Id of the webhook subscription, webhook events are refused until it is set
+STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.getenv("STRAVA_WEBHOOK_SUBSCRIPTION_ID")
+
+SIMPLE_JWT = {
+    'TOKEN_USER_CLASS': 'api.authentication.AthleteTokenUser',
+}
+
+# Seconds during which a user found active is not checked again by the JWT authentication
+JWT_REVOCATION_CACHE_TTL = int(os.getenv("JWT_REVOCATION_CACHE_TTL", default=60))
+
 SWAGGER_SETTINGS = {
     'DEFAULT_FIELD_INSPECTORS': [
         'drf_yasg.inspectors.CamelCaseJSONFilter',
@@ -161,4 +246,9 @@ SWAGGER_SETTINGS = {
         'drf_yasg.inspectors.SimpleFieldInspector',
         'drf_yasg.inspectors.StringDefaultFieldInspector',
     ],
+    # The documentation pages load the generated schema, only introspected again in DEBUG when the URLconf changes.
+    'SPEC_URL': ('schema-json', {'format': '.json'}) if DEBUG else STATIC_URL + 'swagger.json',
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': SWAGGER_SETTINGS['SPEC_URL'],
 }
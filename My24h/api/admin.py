@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Race, Athlete, Activity, Team, Discipline, RaceDiscipline
+from .models import Category, Race, Athlete, Activity, Team, Discipline, RaceDiscipline, StravaSyncJob
 
 
 @admin.register(Category)
@@ -35,3 +35,9 @@ class DisciplineAdmin(admin.ModelAdmin):
 @admin.register(RaceDiscipline)
 class RaceDisciplineAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(StravaSyncJob)
+class StravaSyncJobAdmin(admin.ModelAdmin):
+    list_display = ['athlete', 'status', 'created_at', 'finished_at', 'attempts', 'not_before']
+    list_filter = ['status']
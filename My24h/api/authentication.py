@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTTokenUserAuthentication
+from rest_framework_simplejwt.models import TokenUser
+
+
+class AthleteTokenUser(TokenUser):
+    """
+    Request user built from the access token claims, see `CustomTokenObtainPairSerializer.get_token`.
+
+    `athlete_id` never changes for a user. `team_id` and `admin_team_id` are the memberships at the time the token
+    was issued and may be outdated: rights are always checked against the database when modifying a team.
+    """
+
+    @cached_property
+    def username(self):
+        return self.token.get('name', '')
+
+    @cached_property
+    def athlete_id(self):
+        return self.token.get('athlete_id')
+
+    @cached_property
+    def team_id(self):
+        return self.token.get('team_id')
+
+    @cached_property
+    def admin_team_id(self):
+        return self.token.get('admin_team_id')
+
+
+class ActiveUserCache:
+    """In-process cache of the users allowed to authenticate, so that a user is queried once per `ttl` seconds."""
+    max_size = 10000
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def is_active(self, user_id):
+        now = time.monotonic()
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        active = get_user_model().objects.filter(id=user_id, is_active=True).exists()
+        with self.lock:
+            if len(self.entries) >= self.max_size:
+                self.entries.clear()
+            self.entries[user_id] = (now + self.ttl, active)
+        return active
+
+
+class StatelessJWTAuthentication(JWTTokenUserAuthentication):
+    """
+    Authenticate requests from the JWT claims alone, without loading the user from the database.
+
+    Deleted or deactivated users are still rejected, within `JWT_REVOCATION_CACHE_TTL` seconds.
+    """
+    active_users = ActiveUserCache(settings.JWT_REVOCATION_CACHE_TTL)
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        if not self.active_users.is_active(user.id):
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
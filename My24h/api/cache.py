@@ -0,0 +1,125 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+
+SNAPSHOT_LOCK_TIMEOUT = 10
+# Seconds during which a snapshot can still be served while it is recomputed
+SNAPSHOT_TIMEOUT = 3600
+
+
+def _version_key(group):
+    return f"api:{group}:version"
+
+
+def _lock_key(key):
+    return f"{key}:lock"
+
+
+def snapshot_key(group, name, params):
+    """Key of the `name` snapshot of `group` for the validated `params`, whatever their order in the query string."""
+    return f"api:{group}:{name}:{json.dumps(params, sort_keys=True, separators=(',', ':'))}"
+
+
+def get_version(group):
+    version = cache.get(_version_key(group))
+    if version is None:
+        # Start from the current time rather than 1 so that a version lost by the cache is never reused.
+        cache.add(_version_key(group), time.time_ns(), None)
+        version = cache.get(_version_key(group), time.time_ns())
+    return version
+
+
+def bump_version(group):
+    """Invalidate every response cached for the group."""
+    try:
+        cache.incr(_version_key(group))
+    except ValueError:
+        cache.set(_version_key(group), time.time_ns(), None)
+
+
+def snapshot(key, compute, ttl, group):
+    """
+    Return the value cached under `key`, calling `compute` to refresh it at most once per `ttl` seconds.
+
+    The snapshot is also refreshed early once the version of `group` is bumped. Only the request holding the lock
+    recomputes it, the concurrent ones keep getting the previous snapshot meanwhile (stale-while-revalidate), or wait
+    for the first one when there is none yet.
+    """
+    version = get_version(group)
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version and time.time() - entry[1] < ttl:
+        return entry[2]
+    lock = _lock_key(key)
+    deadline = time.monotonic() + SNAPSHOT_LOCK_TIMEOUT
+    while not cache.add(lock, True, SNAPSHOT_LOCK_TIMEOUT):
+        if entry is not None:
+            return entry[2]
+        if time.monotonic() > deadline:
+            return compute()
+        time.sleep(0.05)
+        entry = cache.get(key)
+    try:
+        value = compute()
+        cache.set(key, (version, time.time(), value), SNAPSHOT_TIMEOUT)
+    finally:
+        cache.delete(lock)
+    return value
+
+
+async def aget_snapshot(key, ttl, group):
+    """
+    Return the value `snapshot` would serve without computing it, or None when it has to be (re)computed.
+
+    Only reads the cache, in a single round trip.
+    """
+    values = await cache.aget_many([key, _version_key(group), _lock_key(key)])
+    entry = values.get(key)
+    if entry is None:
+        return None
+    if entry[0] == values.get(_version_key(group)) and time.time() - entry[1] < ttl:
+        return entry[2]
+    if values.get(_lock_key(key)) is not None:
+        return entry[2]
+    return None
+
+
+class CachedReadMixin:
+    """
+    Serve `list` and `retrieve` JSON responses from the cache, with ETag support.
+
+    Entries are keyed by the version of `cache_group`, which signals bump whenever one of its models changes.
+    """
+    cache_group = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return view(request, *args, **kwargs)
+        key = f"api:{self.cache_group}:{get_version(self.cache_group)}:{request.get_full_path()}"
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            entry = (f'"{hashlib.md5(content).hexdigest()}"', content)
+            cache.set(key, entry, settings.REFERENCE_CACHE_TIMEOUT)
+        etag, content = entry
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
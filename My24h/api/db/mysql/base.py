@@ -0,0 +1,88 @@
+import threading
+
+from django.db.backends.mysql import base
+from django.db.backends.mysql.base import Database
+
+from api.db.pool import ConnectionPool, PoolTimeout
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    MySQL/MariaDB backend adding the CONN_HEALTH_CHECKS setting of Django 4.1 and an optional connection pool.
+
+    With CONN_HEALTH_CHECKS, a reused connection is pinged before its first query of each request instead of failing
+    it when the server closed the connection meanwhile.
+
+    Setting POOL to a dict of MIN_SIZE, MAX_SIZE, TIMEOUT and MAX_IDLE shares the connections between the threads of
+    the process: closing a connection gives it back to the pool. Use it with CONN_MAX_AGE = 0, so that connections are
+    given back at the end of every request. Connections are opened on demand: MIN_SIZE is the number of idle
+    connections kept open however long they are idle, not a number of connections opened up front.
+    """
+    health_check_done = False
+    # Set when the connection failed its health check, so that it is not given back to the pool
+    connection_broken = False
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL')
+        if not options:
+            return None
+        key = (self.alias, self.settings_dict['NAME'])
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = ConnectionPool(
+                    min_size=options.get('MIN_SIZE', 0),
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 10),
+                    max_idle=options.get('MAX_IDLE', 300),
+                    check=self.ping if self.settings_dict.get('CONN_HEALTH_CHECKS') else None,
+                )
+            return _pools[key]
+
+    @staticmethod
+    def ping(connection):
+        try:
+            connection.ping()
+        except Database.Error:
+            return False
+        return True
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            return pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e))
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+        self.connection_broken = False
+
+    def ensure_connection(self):
+        if self.connection is not None and not self.health_check_done and not self.in_atomic_block \
+                and self.settings_dict.get('CONN_HEALTH_CHECKS'):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.connection_broken = True
+                self.close()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        # A broken connection, or one left in a transaction or after an error, is not handed to another thread.
+        reusable = not self.connection_broken and not self.in_atomic_block and not self.errors_occurred \
+            and self.autocommit == self.settings_dict['AUTOCOMMIT']
+        with self.wrap_database_errors:
+            pool.release(self.connection, reusable)
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections.
+
+    At most `max_size` connections are open, in use or idle. Connections are only opened when no idle one is left, so
+    `min_size` is not a number of connections opened up front but a floor: idle connections are reused newest first,
+    the ones idle for more than `max_idle` seconds are closed as long as more than `min_size` remain.
+    """
+
+    def __init__(self, min_size=0, max_size=10, timeout=10, max_idle=300, check=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check = check
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def acquire(self, connect):
+        """Return an idle connection, or one opened with `connect`, waiting at most `timeout` seconds for a slot."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available after {self.timeout}s ({self.max_size} in use).")
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection, _ = self._idle.pop()
+                if self.check is None or self.check(connection):
+                    return connection
+                self._discard(connection)
+            return connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, reusable=True):
+        """Give a connection back, closing it unless `reusable`."""
+        try:
+            if not reusable:
+                self._discard(connection)
+                return
+            now = time.monotonic()
+            expired = []
+            with self._lock:
+                self._idle.append((connection, now))
+                while len(self._idle) > self.min_size and now - self._idle[0][1] > self.max_idle:
+                    expired.append(self._idle.popleft()[0])
+            for connection in expired:
+                self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,20 @@
+from rest_framework import serializers
+
+
+class RankingQuerySerializer(serializers.Serializer):
+    race = serializers.IntegerField(required=False, help_text="Only rank the given race.")
+    category = serializers.IntegerField(required=False, help_text="Only rank the given category.")
+    gender = serializers.ChoiceField(choices=['male', 'female', 'unknown'], required=False,
+                                     help_text="Only count athletes of the given gender.")
+    cursor = serializers.CharField(required=False, help_text="Cursor of the page, as given by `next`.")
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    race = serializers.IntegerField(required=False, help_text="Only export the given race.")
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv',
+                                     help_text="CSV with one column per discipline, or one JSON object per line.")
+
+
+class ActivityFeedQuerySerializer(serializers.Serializer):
+    since = serializers.CharField(required=False, help_text="Sync token of the last response, to only receive the "
+                                                            "activities uploaded or rescored since.")
@@ -0,0 +1,64 @@
+import csv
+import json
+
+from django.db.models import Sum
+
+from .models import Activity, Athlete, Discipline
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+FIELDS = ['athlete_id', 'username', 'first_name', 'last_name', 'gender', 'team', 'category', 'race', 'points']
+CHUNK_SIZE = 1000
+
+
+class Echo:
+    """File-like object handing back what the csv writer writes, so that rows can be yielded one by one."""
+
+    def write(self, value):
+        return value
+
+
+def iter_results(race=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield the results of every athlete, with his/her points per discipline.
+
+    Athletes are read by chunks of increasing ids rather than through a single cursor: MySQL drivers load the whole
+    result set of a query in memory.
+    """
+    disciplines = dict(Discipline.objects.order_by('id').values_list('id', 'name'))
+    athletes = Athlete.objects.order_by('id').values_list(
+        'id', 'user__username', 'user__first_name', 'user__last_name', 'gender', 'team__name', 'category__name',
+        'race__name', 'points')
+    if race is not None:
+        athletes = athletes.filter(race=race)
+    last_id = 0
+    while chunk := list(athletes.filter(id__gt=last_id)[:chunk_size]):
+        last_id = chunk[-1][0]
+        breakdown = {}
+        activities = Activity.objects.filter(athlete_id__in=[row[0] for row in chunk], discipline__isnull=False) \
+            .order_by().values_list('athlete_id', 'discipline_id').annotate(total=Sum('points'))
+        for athlete_id, discipline_id, total in activities:
+            if discipline_id in disciplines:
+                points = breakdown.setdefault(athlete_id, {})
+                points[disciplines[discipline_id]] = points.get(disciplines[discipline_id], 0) + total
+        for row in chunk:
+            result = dict(zip(FIELDS, row))
+            result['disciplines'] = {name: breakdown.get(row[0], {}).get(name, 0) for name in disciplines.values()}
+            yield result
+
+
+def stream_results(output, race=None, chunk_size=CHUNK_SIZE):
+    """Serialize the results line by line, as CSV with one column per discipline or as JSON lines."""
+    results = iter_results(race, chunk_size)
+    if output == 'csv':
+        writer = csv.writer(Echo())
+        disciplines = list(Discipline.objects.order_by('id').values_list('name', flat=True))
+        yield writer.writerow(FIELDS + disciplines)
+        for result in results:
+            yield writer.writerow([result[field] for field in FIELDS]
+                                  + [result['disciplines'].get(name, 0) for name in disciplines])
+    else:
+        for result in results:
+            yield json.dumps(result) + '\n'
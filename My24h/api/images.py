@@ -0,0 +1,94 @@
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Pillow formats accepted for uploaded pictures, with the extension they are stored under
+FORMATS = {
+    'JPEG': 'jpg',
+    'PNG': 'png',
+    'WEBP': 'webp',
+}
+# Thumbnail fields, with the format, extension and encoder options of their files
+THUMBNAILS = {
+    'thumbnail': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'thumbnail_jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+def replace_picture(instance, picture):
+    """
+    Store a validated upload as the picture of an athlete or a team.
+
+    The previous picture and thumbnails are removed once committed, the new thumbnails are generated in the
+    background by the `generate_thumbnails` command.
+    """
+    field = instance._meta.get_field('image')
+    previous = [getattr(instance, name).name for name in ['image', *THUMBNAILS] if getattr(instance, name)]
+    name = field.storage.save(field.generate_filename(instance, f"{instance.pk}.{FORMATS[picture.image.format]}"),
+                              picture)
+    type(instance).objects.filter(pk=instance.pk).update(image=name, **{thumbnail: '' for thumbnail in THUMBNAILS})
+    instance.image = name
+    for thumbnail in THUMBNAILS:
+        setattr(instance, thumbnail, '')
+    transaction.on_commit(lambda: [field.storage.delete(path) for path in previous])
+
+
+def render_thumbnails(file):
+    # Pillow is only loaded by the thumbnails worker, not by every web worker.
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(file))
+    image = ImageOps.fit(image.convert('RGB'), (settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE), Image.LANCZOS)
+    rendered = {}
+    for field, (image_format, extension, options) in THUMBNAILS.items():
+        buffer = io.BytesIO()
+        image.save(buffer, image_format, **options)
+        rendered[field] = (extension, buffer.getvalue())
+    return rendered
+
+
+def generate_thumbnails(instance):
+    """
+    Render and store the thumbnails of an athlete or team picture, unless a new picture was uploaded meanwhile.
+
+    Thumbnail names end with a hash of their content, so that clients can cache them forever.
+    """
+    with instance.image.open('rb') as file:
+        rendered = render_thumbnails(file)
+    names = {}
+    for field, (extension, content) in rendered.items():
+        model_field = instance._meta.get_field(field)
+        digest = hashlib.sha1(content).hexdigest()[:12]
+        name = model_field.generate_filename(instance, f"{instance.pk}-{digest}.{extension}")
+        if not model_field.storage.exists(name):
+            name = model_field.storage.save(name, ContentFile(content))
+        names[field] = name
+    if not type(instance).objects.filter(pk=instance.pk, image=instance.image.name).update(**names):
+        for field, name in names.items():
+            instance._meta.get_field(field).storage.delete(name)
+        return False
+    return True
+
+
+def generate_pending_thumbnails(models, limit):
+    """Generate the thumbnails missing for at most `limit` pictures of each model, returning how many were made."""
+    from PIL import Image
+
+    generated = 0
+    for model in models:
+        pending = model.objects.exclude(image='').exclude(image__isnull=True).filter(thumbnail='') \
+            .order_by('pk').only('pk', 'image')
+        for instance in pending[:limit]:
+            try:
+                generated += generate_thumbnails(instance)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                # Unreadable picture: drop it rather than trying again on every run.
+                logger.exception("Cannot generate the thumbnails of %s %s", model.__name__, instance.pk)
+                model.objects.filter(pk=instance.pk, image=instance.image.name).update(image='')
+    return generated
@@ -0,0 +1,68 @@
+import re
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Activity, ActivityDeletion, Athlete, StravaActivity, StravaSyncJob
+from api.pagination import RankingPagination
+from api.views import RankingViewSet
+
+# EXPLAIN output line of a query reading a whole table, per database vendor
+FULL_SCANS = {
+    'sqlite': re.compile(r'\bSCAN \w+\b(?! USING)'),
+    'postgresql': re.compile(r'Seq Scan on'),
+    'mysql': re.compile(r'"access_type":\s*"ALL"'),
+}
+EXPLAIN_FORMATS = {
+    'mysql': 'json',
+}
+
+
+def key_queries():
+    now = timezone.now()
+    # Pages of the rankings, as queried by RankingViewSet
+    pagination = RankingPagination()
+    filters = {'race': 1, 'category': 1, 'gender': 'female'}
+    cursor = {'total': 10.0, 'id': 1, 'rank': 1, 'seen': 1}
+    return {
+        'athlete activities': Activity.objects.filter(athlete_id=1, date__gte=now).order_by('date'),
+        'athlete activity feed': Activity.objects.filter(athlete_id=1, updated_at__gt=now).order_by('updated_at'),
+        'athlete activity deletions': ActivityDeletion.objects.filter(athlete_id=1, deleted_at__gt=now)
+        .order_by('deleted_at'),
+        'athlete strava activities': StravaActivity.objects.filter(athlete_id=1).order_by('start_date'),
+        'strava activities to promote': StravaActivity.objects.filter(updated_at__gt=now).order_by('updated_at'),
+        'athletes ranking': pagination.page_queryset(RankingViewSet.athletes_queryset(filters), cursor),
+        'teams ranking': pagination.page_queryset(RankingViewSet.teams_queryset(filters), cursor),
+        'expiring tokens': Athlete.objects.filter(refresh_token__isnull=False, access_token_expiration_date__lte=now)
+        .order_by('access_token_expiration_date'),
+        'webhook athlete': Athlete.objects.filter(strava_id=1).order_by(),
+        'pending sync jobs': StravaSyncJob.objects.filter(status=StravaSyncJob.PENDING).order_by('created_at'),
+    }
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN on the hot queries of the API and fail if any of them reads a whole table."
+
+    def handle(self, *args, **options):
+        full_scan = FULL_SCANS.get(connection.vendor)
+        if full_scan is None:
+            raise CommandError(f"EXPLAIN output of {connection.vendor} databases is not supported.")
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Small tables are cheaper to read sequentially: only fall back to it when no index applies.
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in key_queries().items():
+                plan = queryset.explain(format=EXPLAIN_FORMATS.get(connection.vendor))
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{name}:\n{plan}")
+                if full_scan.search(plan):
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(f"{name}: full scan"))
+                else:
+                    self.stdout.write(f"{name}: ok")
+        if failures:
+            raise CommandError(f"{len(failures)} queries read a whole table: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('All queries use an index.'))
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from api import export
+
+
+class Command(BaseCommand):
+    help = "Write the results of every athlete, with his/her points per discipline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=list(export.CONTENT_TYPES), default='csv')
+        parser.add_argument('--race', type=int, help="Only export the given race.")
+        parser.add_argument('--file', help="File to write, the standard output by default.")
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE,
+                            help="Number of athletes read per query.")
+
+    def handle(self, *args, **options):
+        file = open(options['file'], 'w', newline='') if options['file'] else self.stdout
+        try:
+            for line in export.stream_results(options['output'], options['race'], options['chunk_size']):
+                file.write(line)
+        finally:
+            if file is not self.stdout:
+                file.close()
@@ -0,0 +1,25 @@
+import os
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from My24h.schema import SCHEMA_FILES, encode_schema, generate_schema
+
+
+class Command(BaseCommand):
+    help = "Write the OpenAPI schema of the API to SCHEMA_ROOT, from where it is collected as a static file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['json', 'yaml'], action='append',
+                            help="Schema format to write, all of them by default.")
+
+    def handle(self, *args, **options):
+        extensions = [f".{name}" for name in options['format']] if options['format'] else list(SCHEMA_FILES)
+        schema = generate_schema()
+        os.makedirs(settings.SCHEMA_ROOT, exist_ok=True)
+        for extension in extensions:
+            content = encode_schema(schema, extension)
+            path = os.path.join(settings.SCHEMA_ROOT, SCHEMA_FILES[extension][0])
+            with open(path, 'wb') as file:
+                file.write(content)
+            self.stdout.write(f"Schema written to {path}")
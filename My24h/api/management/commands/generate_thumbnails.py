@@ -0,0 +1,28 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from api import images
+from api.models import Athlete, Team
+
+
+class Command(BaseCommand):
+    help = "Generate the thumbnails of the athletes and teams pictures uploaded since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Maximum number of pictures of each model processed per round.")
+        parser.add_argument('--loop', action='store_true', help="Keep generating until interrupted.")
+        parser.add_argument('--sleep', type=float, default=5, help="Seconds to wait between two idle rounds.")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            generated = images.generate_pending_thumbnails([Athlete, Team], options['batch_size'])
+            if generated:
+                self.stdout.write(f"{generated} picture(s) processed.")
+            if not options['loop']:
+                break
+            if not generated:
+                time.sleep(options['sleep'])
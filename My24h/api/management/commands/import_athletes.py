@@ -0,0 +1,159 @@
+import csv
+import datetime
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import DatabaseError, transaction
+
+from api.models import Athlete, Race
+
+REQUIRED_FIELDS = ["username", "first_name", "last_name", "email", "password", "birthdate", "gender", "address",
+                   "zip_code", "city", "race_id"]
+GENDERS = {gender for gender, _ in Athlete._meta.get_field('gender').choices}
+MAX_LENGTHS = {field: model._meta.get_field(field).max_length for model, fields in [
+    (User, ["username", "first_name", "last_name", "email"]),
+    (Athlete, ["address", "zip_code", "city", "phone"]),
+] for field in fields}
+
+
+def read_rows(file, file_format):
+    """Yield the line number and the fields of every registration of the file."""
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_num, row if isinstance(row, dict) else None
+
+
+def validate(row, race_ids, usernames):
+    """Return the cleaned registration and the list of errors making it invalid."""
+    if row is None:
+        return {}, ["not a JSON object"]
+    row = {key: str(value).strip() for key, value in row.items() if key and value is not None}
+    errors = [f"missing {field}" for field in REQUIRED_FIELDS if not row.get(field)]
+    if row.get("birthdate"):
+        try:
+            row["birthdate"] = datetime.datetime.strptime(row["birthdate"], "%Y-%m-%d").date()
+        except ValueError:
+            errors.append("birthdate should be in YYYY-mm-dd format")
+    if row.get("gender") and row["gender"] not in GENDERS:
+        errors.append(f"gender should be one of {', '.join(sorted(GENDERS))}")
+    if row.get("race_id") and row["race_id"] not in race_ids:
+        errors.append(f"race {row['race_id']} does not exist")
+    if row.get("email"):
+        try:
+            validate_email(row["email"])
+        except ValidationError:
+            errors.append("email is not valid")
+    errors += [f"{field} is too long" for field, max_length in MAX_LENGTHS.items()
+               if len(row.get(field, "")) > max_length]
+    if row.get("username") in usernames:
+        errors.append("username is already used")
+    return row, errors
+
+
+def create_athletes(rows, passwords):
+    users = [User(username=row["username"], email=row["email"], first_name=row["first_name"],
+                  last_name=row["last_name"], password=password) for row, password in zip(rows, passwords)]
+    User.objects.bulk_create(users)
+    if users and users[0].pk is None:
+        # The database does not return the primary keys of inserted rows (MySQL).
+        ids = dict(User.objects.filter(username__in=[user.username for user in users]).values_list('username', 'id'))
+        for user in users:
+            user.pk = ids[user.username]
+    Athlete.objects.bulk_create(
+        Athlete(user=user, gender=row["gender"], birthday=row["birthdate"], address=row["address"],
+                zip_code=row["zip_code"], city=row["city"], phone=row.get("phone") or None, race_id=int(row["race_id"]))
+        for row, user in zip(rows, users)
+    )
+
+
+class Command(BaseCommand):
+    help = "Register the athletes listed in a CSV or JSON lines file, with the fields expected by the athlete " \
+           "creation endpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for the standard input.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help="File format, guessed from its extension by default.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of athletes inserted per transaction.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Number of processes hashing the passwords.")
+        parser.add_argument('--report', help="CSV file listing the rejected rows, the standard error by default.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        try:
+            file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        report_file = open(options['report'], 'w', newline='') if options['report'] else self.stderr
+        report = csv.writer(report_file)
+        report.writerow(["line", "username", "error"])
+        race_ids = {str(race_id) for race_id in Race.objects.values_list('id', flat=True)}
+        imported = rejected = 0
+        try:
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+                rows = read_rows(file, file_format)
+                while batch := list(itertools.islice(rows, options['batch_size'])):
+                    batch_usernames = [str(row.get("username", "")).strip() for _, row in batch if row]
+                    usernames = set(User.objects.filter(username__in=batch_usernames)
+                                    .values_list('username', flat=True))
+                    valid = []
+                    for line_num, row in batch:
+                        row, errors = validate(row, race_ids, usernames)
+                        if errors:
+                            rejected += 1
+                            report.writerow([line_num, row.get("username", ""), "; ".join(errors)])
+                            continue
+                        usernames.add(row["username"])
+                        valid.append((line_num, row))
+                    chunk_size = max(1, len(valid) // (options['workers'] * 4))
+                    passwords = list(executor.map(make_password, [row["password"] for _, row in valid],
+                                                  chunksize=chunk_size))
+                    for (line_num, row), error in self.insert(valid, passwords):
+                        if error:
+                            rejected += 1
+                            report.writerow([line_num, row["username"], error])
+                        else:
+                            imported += 1
+        finally:
+            if file is not sys.stdin:
+                file.close()
+            if report_file is not self.stderr:
+                report_file.close()
+        self.stdout.write(self.style.SUCCESS(f"{imported} athlete(s) imported, {rejected} row(s) rejected."))
+
+    def insert(self, rows, passwords):
+        """Insert the rows in one transaction, falling back to one row at a time to isolate the failing ones."""
+        try:
+            with transaction.atomic():
+                create_athletes([row for _, row in rows], passwords)
+            return [(row, None) for row in rows]
+        except DatabaseError:
+            results = []
+            for row, password in zip(rows, passwords):
+                try:
+                    with transaction.atomic():
+                        create_athletes([row[1]], [password])
+                    results.append((row, None))
+                except DatabaseError as e:
+                    results.append((row, str(e)))
+            return results
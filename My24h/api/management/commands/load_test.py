@@ -0,0 +1,50 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Send concurrent requests to a running server and report its throughput and latencies, e.g. to compare " \
+           "the WSGI and ASGI serving modes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help="URLs requested in turn by every client.")
+        parser.add_argument('--concurrency', type=int, default=50, help="Number of concurrent clients.")
+        parser.add_argument('--requests', type=int, default=1000, help="Total number of requests.")
+        parser.add_argument('--token', help="Access token sent as a bearer token.")
+        parser.add_argument('--timeout', type=float, default=30, help="Seconds before a request is failed.")
+
+    def handle(self, *args, **options):
+        headers = {'Authorization': f"Bearer {options['token']}"} if options['token'] else {}
+        sessions = threading.local()
+
+        def send(index):
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+                sessions.session.headers.update(headers)
+            start = time.perf_counter()
+            try:
+                response = sessions.session.get(options['urls'][index % len(options['urls'])],
+                                                timeout=options['timeout'])
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(send, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+        latencies = sorted(latency for ok, latency in results if ok)
+        errors = len(results) - len(latencies)
+        if not latencies:
+            raise CommandError(f"All the {errors} requests failed.")
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(f"{len(results)} requests in {elapsed:.2f}s: {len(results) / elapsed:.1f} req/s, "
+                          f"{errors} error(s)")
+        self.stdout.write(f"latency p50 {percentiles[49] * 1000:.0f}ms, p95 {percentiles[94] * 1000:.0f}ms, "
+                          f"p99 {percentiles[98] * 1000:.0f}ms, max {latencies[-1] * 1000:.0f}ms")
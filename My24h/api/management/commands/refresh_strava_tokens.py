@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from api import strava, sync
+
+
+class Command(BaseCommand):
+    help = "Refresh the Strava access tokens about to expire."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--within', type=int, default=settings.STRAVA_TOKEN_REFRESH_MARGIN,
+                            help="Refresh the tokens expiring in the next given minutes.")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=settings.STRAVA_SYNC_WORKERS,
+                            help="Number of concurrent Strava requests.")
+        parser.add_argument('--loop', action='store_true', help="Keep refreshing until interrupted.")
+        parser.add_argument('--sleep', type=float, default=60, help="Seconds to wait between two rounds.")
+
+    def handle(self, *args, **options):
+        client = strava.StravaClient(pool_size=options['workers'])
+        while True:
+            close_old_connections()
+            refreshed, failed = sync.refresh_expiring_tokens(client, options['within'] * 60, options['batch_size'],
+                                                             options['workers'])
+            if refreshed or failed:
+                self.stdout.write(f"{refreshed} token(s) refreshed, {failed} failed.")
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,38 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from api.models import Activity, Athlete, Team
+
+
+def _total(queryset, group_by):
+    return Coalesce(Subquery(queryset.order_by().values(group_by).annotate(total=Sum('points')).values('total')),
+                    Value(0.0), output_field=FloatField())
+
+
+class Command(BaseCommand):
+    help = "Recompute the points of every activity and rebuild the athletes and teams totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        with transaction.atomic():
+            batch = []
+            for activity in Activity.objects.select_related('discipline').iterator(chunk_size=batch_size):
+                points = activity.compute_points()
+                if points == activity.points:
+                    continue
+                activity.points, activity.updated_at = points, now
+                batch.append(activity)
+                if len(batch) >= batch_size:
+                    Activity.objects.bulk_update(batch, ['points', 'updated_at'])
+                    batch = []
+            Activity.objects.bulk_update(batch, ['points', 'updated_at'])
+            Athlete.objects.update(points=_total(Activity.objects.filter(athlete=OuterRef('pk')), 'athlete'))
+            Team.objects.update(points=_total(Athlete.objects.filter(team=OuterRef('pk')), 'team'))
+        self.stdout.write(self.style.SUCCESS('Points recomputed.'))
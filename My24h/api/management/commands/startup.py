@@ -0,0 +1,68 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.management import BaseCommand, call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+# File of STATIC_ROOT holding the fingerprint of the static files it was collected from
+STATIC_FINGERPRINT = '.collectstatic'
+
+
+def static_fingerprint():
+    """Hash the paths, sizes and modification times of the static files to collect."""
+    entries = []
+    for finder in finders.get_finders():
+        for path, storage in finder.list(['CVS', '.*', '*~']):
+            stat = os.stat(storage.path(path))
+            entries.append(f"{storage.path(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    digest = hashlib.sha256(settings.STATICFILES_STORAGE.encode())
+    for entry in sorted(entries):
+        digest.update(entry.encode())
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = "Prepare a container for serving: wait for the database, then apply the pending migrations and collect " \
+           "the static files if they changed, reporting the duration of each phase."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=60, help="Seconds to wait for the database.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        for name, phase in [('database', self.wait_for_database), ('migrate', self.migrate),
+                            ('collectstatic', self.collectstatic)]:
+            phase_start = time.perf_counter()
+            result = phase(options)
+            self.stdout.write(f"{name}: {result} ({time.perf_counter() - phase_start:.2f}s)")
+        self.stdout.write(self.style.SUCCESS(f"Ready in {time.perf_counter() - start:.2f}s."))
+
+    def wait_for_database(self, options):
+        call_command('w8_4_db', timeout=options['timeout'], stdout=self.stdout)
+        return "available"
+
+    def migrate(self, options):
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not plan:
+            return "up to date"
+        call_command('migrate', interactive=False, verbosity=options['verbosity'])
+        return f"{len(plan)} migration(s) applied"
+
+    def collectstatic(self, options):
+        fingerprint = static_fingerprint()
+        path = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT)
+        try:
+            with open(path) as file:
+                if file.read() == fingerprint:
+                    return "unchanged"
+        except OSError:
+            pass
+        call_command('collectstatic', interactive=False, verbosity=options['verbosity'] - 1)
+        with open(path, 'w') as file:
+            file.write(fingerprint)
+        return "collected"
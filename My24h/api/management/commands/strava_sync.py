@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from api import pipeline, strava, sync
+from api.models import StravaSyncJob
+
+
+class Command(BaseCommand):
+    help = "Queue the athletes whose Strava activities are stale and synchronize them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.STRAVA_SYNC_WORKERS,
+                            help="Number of concurrent Strava requests.")
+        parser.add_argument('--limit', type=int, default=100, help="Maximum number of jobs processed per round.")
+        parser.add_argument('--loop', action='store_true', help="Keep synchronizing until interrupted.")
+        parser.add_argument('--sleep', type=float, default=5, help="Seconds to wait between two idle rounds.")
+
+    def handle(self, *args, **options):
+        client = strava.StravaClient(pool_size=options['workers'])
+        while True:
+            close_old_connections()
+            queued = sync.enqueue_stale_athletes()
+            jobs = sync.run_jobs(options['limit'], options['workers'], client)
+            promoted = pipeline.promote_strava_activities()
+            failed = sum(job.status == StravaSyncJob.FAILED for job in jobs)
+            retried = sum(job.status == StravaSyncJob.PENDING for job in jobs)
+            if jobs or queued:
+                self.stdout.write(f"{queued} athlete(s) queued, {len(jobs)} job(s) processed, {failed} failed, "
+                                  f"{retried} to retry, {promoted} activity(ies) scored.")
+            if not options['loop']:
+                break
+            if not jobs:
+                time.sleep(options['sleep'])
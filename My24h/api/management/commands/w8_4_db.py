@@ -1,18 +1,32 @@
 import time
-from django.db import connections
+
+from django.core.management import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.db.utils import OperationalError
-from django.core.management import BaseCommand
 
 
 class Command(BaseCommand):
+    help = "Wait until the database accepts connections, retrying with an exponential backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to wait for.")
+        parser.add_argument('--timeout', type=float, default=60, help="Seconds to wait before failing.")
+        parser.add_argument('--max-delay', type=float, default=2, help="Maximum number of seconds between attempts.")
 
     def handle(self, *args, **options):
-        self.stdout.write('Waiting for MariaDB...')
-        db_conn = None
-        while not db_conn:
+        connection = connections[options['database']]
+        self.stdout.write(f"Waiting for {connection.display_name}...")
+        deadline = time.monotonic() + options['timeout']
+        delay = 0.1
+        while True:
             try:
-                db_conn = connections['default']
-            except OperationalError:
-                self.stdout.write('MariaDB unavailable, waiting 1 second...')
-                time.sleep(1)
-        self.stdout.write('MariaDB available!')
+                connection.ensure_connection()
+                break
+            except OperationalError as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError(f"{connection.display_name} unavailable after {options['timeout']}s: {e}")
+                self.stdout.write(f"{connection.display_name} unavailable, retrying in {min(delay, remaining):.1f}s...")
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, options['max_delay'])
+        self.stdout.write(f"{connection.display_name} available!")
@@ -0,0 +1,47 @@
+import asyncio
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import reverse
+from rest_framework.exceptions import APIException
+
+from .cache import aget_snapshot
+
+
+class RankingSnapshotMiddleware:
+    """
+    Answer the rankings requests from their cached snapshot, without going through the views.
+
+    Under ASGI, serving a snapshot skips the synchronous middlewares and views, which each run in a thread. Requests
+    whose snapshot has to be computed, and every request under WSGI, are handled by `RankingViewSet`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = None
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        from .views import RankingViewSet
+
+        if self.paths is None:
+            self.paths = {reverse(f'Rankings-{ranking}'): ranking for ranking in ('athletes', 'teams')}
+        if request.method == 'GET' and request.path in self.paths:
+            try:
+                key = RankingViewSet.snapshot_key(self.paths[request.path], request.GET)
+            except APIException:
+                # Invalid queries get their error from the view.
+                return await self.get_response(request)
+            value = await aget_snapshot(key, settings.RANKING_SNAPSHOT_TTL, 'rankings')
+            if value is not None:
+                return JsonResponse(value)
+        return await self.get_response(request)
@@ -0,0 +1,174 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:02
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Athlete',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(choices=[('male', 'male'), ('female', 'female'), ('unknown', 'unknown')], max_length=20)),
+                ('birthday', models.DateField()),
+                ('address', models.CharField(max_length=100, null=True)),
+                ('zip_code', models.CharField(max_length=5, null=True)),
+                ('city', models.CharField(max_length=100, null=True)),
+                ('phone', models.CharField(max_length=20, null=True)),
+                ('image', models.ImageField(null=True, upload_to='')),
+                ('strava_id', models.IntegerField(null=True)),
+                ('access_token', models.CharField(max_length=800, null=True)),
+                ('access_token_expiration_date', models.DateTimeField(null=True)),
+                ('refresh_token', models.CharField(max_length=800, null=True)),
+                ('last_update', models.DateTimeField(null=True)),
+            ],
+            options={
+                'verbose_name': 'Athlete',
+                'verbose_name_plural': 'Athletes',
+                'ordering': ['user__username'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('label', models.TextField(max_length=500)),
+                ('max_participants', models.IntegerField()),
+            ],
+            options={
+                'verbose_name': 'Category',
+                'verbose_name_plural': 'Categories',
+                'ordering': ['max_participants'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Discipline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('points_per_km', models.FloatField(default=0)),
+                ('elevation_gain_coeff', models.FloatField(default=0)),
+                ('duration_coeff', models.FloatField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Discipline',
+                'verbose_name_plural': 'Disciplines',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Race',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+            ],
+            options={
+                'verbose_name': 'Race',
+                'verbose_name_plural': 'Races',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Team',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('join_code', models.CharField(max_length=50, verbose_name='Join Code')),
+                ('image', models.ImageField(upload_to='')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='teams', to='api.category')),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='teams', to='api.race')),
+            ],
+            options={
+                'verbose_name': 'Team',
+                'verbose_name_plural': 'Teams',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StravaActivity',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=500)),
+                ('type', models.CharField(max_length=50)),
+                ('distance', models.FloatField()),
+                ('moving_time', models.DurationField()),
+                ('total_elevation_gain', models.FloatField()),
+                ('start_date', models.DateTimeField()),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='strava_activities', to='api.athlete')),
+            ],
+            options={
+                'verbose_name': 'Strava Activity',
+                'verbose_name_plural': 'Strava Activities',
+                'db_table': 'api_strava_activity',
+                'ordering': ['start_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RaceDiscipline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('duration', models.DurationField(default=datetime.timedelta(days=1))),
+                ('discipline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='races', to='api.discipline')),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='disciplines', to='api.race')),
+            ],
+            options={
+                'db_table': 'api_race_discipline',
+            },
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='admin',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admins', to='api.team'),
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='category',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='category', to='api.category'),
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='race',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='race', to='api.race'),
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='team',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='api.team'),
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Activity',
+            fields=[
+                ('activity_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateTimeField()),
+                ('upload_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('distance', models.FloatField()),
+                ('positive_elevation_gain', models.PositiveIntegerField()),
+                ('negative_elevation_gain', models.PositiveIntegerField()),
+                ('run_time', models.DurationField()),
+                ('avg_speed', models.FloatField()),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='api.athlete')),
+            ],
+            options={
+                'verbose_name': 'Activity',
+                'verbose_name_plural': 'Activities',
+                'ordering': ['upload_date'],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='discipline',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activities', to='api.discipline'),
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='points',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='points',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='points',
+            field=models.FloatField(default=0),
+        ),
+    ]
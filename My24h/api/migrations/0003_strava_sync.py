@@ -0,0 +1,34 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_activity_points'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StravaSyncJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='strava_sync_jobs', to='api.athlete')),
+            ],
+            options={
+                'verbose_name': 'Strava Sync Job',
+                'verbose_name_plural': 'Strava Sync Jobs',
+                'db_table': 'api_strava_sync_job',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
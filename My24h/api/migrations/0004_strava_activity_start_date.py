@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_strava_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='race',
+            name='start_date',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
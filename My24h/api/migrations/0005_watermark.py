@@ -0,0 +1,36 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_strava_activity_start_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Watermark',
+                'verbose_name_plural': 'Watermarks',
+            },
+        ),
+        migrations.AddField(
+            model_name='discipline',
+            name='strava_type',
+            field=models.CharField(blank=True, default='', max_length=50, verbose_name='Strava activity type'),
+        ),
+        migrations.AddField(
+            model_name='stravaactivity',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
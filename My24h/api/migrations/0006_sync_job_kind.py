@@ -0,0 +1,23 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stravasyncjob',
+            name='activity_id',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='stravasyncjob',
+            name='kind',
+            field=models.CharField(choices=[('sync', 'sync'), ('fetch_activity', 'fetch activity'), ('delete_activity', 'delete activity'), ('deauthorize', 'deauthorize')], default='sync', max_length=20),
+        ),
+    ]
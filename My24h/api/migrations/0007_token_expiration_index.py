@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_sync_job_kind'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='athlete',
+            name='access_token_expiration_date',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_token_expiration_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='athlete',
+            name='strava_id',
+            field=models.IntegerField(db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='stravaactivity',
+            name='updated_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['athlete', 'date'], name='activity_athlete_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='athlete',
+            index=models.Index(fields=['race', 'category', 'gender'], name='athlete_ranking_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stravaactivity',
+            index=models.Index(fields=['athlete', 'start_date'], name='strava_athlete_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stravasyncjob',
+            index=models.Index(fields=['status', 'created_at'], name='sync_job_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['race', 'category'], name='team_race_category_idx'),
+        ),
+    ]
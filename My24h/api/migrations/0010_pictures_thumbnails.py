@@ -0,0 +1,43 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_activity_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='athlete',
+            name='thumbnail',
+            field=models.ImageField(blank=True, default='', upload_to='athletes/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='athlete',
+            name='thumbnail_jpeg',
+            field=models.ImageField(blank=True, default='', upload_to='athletes/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='thumbnail',
+            field=models.ImageField(blank=True, default='', upload_to='teams/thumbnails/'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='thumbnail_jpeg',
+            field=models.ImageField(blank=True, default='', upload_to='teams/thumbnails/'),
+        ),
+        migrations.AlterField(
+            model_name='athlete',
+            name='image',
+            field=models.ImageField(null=True, upload_to='athletes/'),
+        ),
+        migrations.AlterField(
+            model_name='team',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='teams/'),
+        ),
+    ]
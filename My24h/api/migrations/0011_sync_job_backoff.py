@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_pictures_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stravasyncjob',
+            name='not_before',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
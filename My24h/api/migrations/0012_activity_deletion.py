@@ -0,0 +1,33 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_sync_job_backoff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('athlete', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='activity_deletions', to='api.athlete')),
+            ],
+            options={
+                'verbose_name': 'Activity Deletion',
+                'verbose_name_plural': 'Activity Deletions',
+                'db_table': 'api_activity_deletion',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='activitydeletion',
+            index=models.Index(fields=['athlete', 'deleted_at'], name='deletion_athlete_date_idx'),
+        ),
+    ]
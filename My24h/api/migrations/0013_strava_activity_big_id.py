@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_activity_deletion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stravaactivity',
+            name='id',
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+    ]
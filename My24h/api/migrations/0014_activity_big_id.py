@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_strava_activity_big_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='activity_id',
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_activity_big_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activitydeletion',
+            name='activity_id',
+            field=models.BigIntegerField(),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.2 on 2026-10-18 17:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def copy_upload_date(apps, schema_editor):
+    # Existing activities were last changed when last uploaded.
+    Activity = apps.get_model('api', 'Activity')
+    Activity.objects.update(updated_at=models.F('upload_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_activity_deletion_big_id'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activity',
+            name='activity_athlete_upload_idx',
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_upload_date, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['athlete', 'updated_at'], name='activity_athlete_updated_idx'),
+        ),
+    ]
@@ -1,11 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from datetime import timedelta
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .cache import bump_version
+
 
 class Discipline(models.Model):
     name = models.CharField(max_length=30)
+    strava_type = models.CharField(max_length=50, blank=True, default="", verbose_name="Strava activity type")
     points_per_km = models.FloatField(default=0)
     elevation_gain_coeff = models.FloatField(default=0)
     duration_coeff = models.FloatField(default=0)
@@ -18,9 +22,16 @@ class Discipline(models.Model):
     def __str__(self):
         return self.name
 
+    def compute_points(self, distance, elevation_gain, duration):
+        # distance is in meters, elevation gain in meters and duration a timedelta
+        return distance / 1000 * self.points_per_km \
+            + elevation_gain * self.elevation_gain_coeff \
+            + duration.total_seconds() / 3600 * self.duration_coeff
+
 
 class Race(models.Model):
     name = models.CharField(max_length=30)
+    start_date = models.DateTimeField(null=True)
 
     class Meta:
         ordering = ['name']
@@ -60,12 +71,16 @@ class Category(models.Model):
 class Team(models.Model):
     name = models.CharField(max_length=50, unique=True)
     join_code = models.CharField(max_length=50, verbose_name="Join Code")
-    image = models.ImageField()
+    image = models.ImageField(upload_to='teams/', blank=True)
+    thumbnail = models.ImageField(upload_to='teams/thumbnails/', blank=True, default='')
+    thumbnail_jpeg = models.ImageField(upload_to='teams/thumbnails/', blank=True, default='')
     race = models.ForeignKey(Race, related_name='teams', on_delete=models.CASCADE)
     category = models.ForeignKey(Category, related_name='teams', on_delete=models.CASCADE)
+    points = models.FloatField(default=0)
 
     class Meta:
         ordering = ['name']
+        indexes = [models.Index(fields=['race', 'category'], name='team_race_category_idx')]
         verbose_name = 'Team'
         verbose_name_plural = 'Teams'
 
@@ -81,45 +96,127 @@ class Athlete(models.Model):
     zip_code = models.CharField(max_length=5, null=True)
     city = models.CharField(max_length=100, null=True)
     phone = models.CharField(max_length=20, null=True)
-    image = models.ImageField(null=True)
-    strava_id = models.IntegerField(null=True)
+    image = models.ImageField(upload_to='athletes/', null=True)
+    thumbnail = models.ImageField(upload_to='athletes/thumbnails/', blank=True, default='')
+    thumbnail_jpeg = models.ImageField(upload_to='athletes/thumbnails/', blank=True, default='')
+    strava_id = models.IntegerField(null=True, db_index=True)
     access_token = models.CharField(max_length=800, null=True)
-    access_token_expiration_date = models.DateTimeField(null=True)
+    access_token_expiration_date = models.DateTimeField(null=True, db_index=True)
     refresh_token = models.CharField(max_length=800, null=True)
     last_update = models.DateTimeField(null=True)
     race = models.ForeignKey(Race, default=None, null=True, related_name="race", on_delete=models.SET_NULL)
     category = models.ForeignKey(Category, default=None, null=True, related_name="category", on_delete=models.SET_NULL)
     team = models.ForeignKey(Team, default=None, null=True, related_name="members", on_delete=models.SET_NULL)
     admin = models.ForeignKey(Team, default=None, null=True, related_name="admins", on_delete=models.SET_NULL)
+    points = models.FloatField(default=0)
 
     class Meta:
         ordering = ['user__username']
+        indexes = [models.Index(fields=['race', 'category', 'gender'], name='athlete_ranking_idx')]
         verbose_name = 'Athlete'
         verbose_name_plural = 'Athletes'
 
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            # The points are a running total only changed by credit_points: a full save of a stale instance must not
+            # overwrite them.
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'points']
+        elif 'team' not in update_fields and 'team_id' not in update_fields:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            # The team is compared with the locked row rather than the instance, which may be stale.
+            previous = Athlete.objects.select_for_update().filter(pk=self.pk).values_list('team_id', 'points').first()
+            super().save(*args, **kwargs)
+            if previous is None or previous[0] == self.team_id:
+                return
+            # The athlete changes team: move his/her points from the old team total to the new one.
+            team_id, points = previous
+            if team_id is not None:
+                Team.objects.filter(pk=team_id).update(points=F('points') - points)
+            if self.team_id is not None:
+                Team.objects.filter(pk=self.team_id).update(points=F('points') + points)
+            transaction.on_commit(invalidate_rankings)
+
+
+def credit_points(athlete_points):
+    """Add points deltas, keyed by athlete id, to the athletes and teams running totals."""
+    for athlete_id, delta in athlete_points.items():
+        if delta:
+            Athlete.objects.filter(pk=athlete_id).update(points=F('points') + delta)
+            Team.objects.filter(members__id=athlete_id).update(points=F('points') + delta)
+    if any(athlete_points.values()):
+        transaction.on_commit(invalidate_rankings)
+
+
+def invalidate_rankings():
+    bump_version('rankings')
+
 
 class Activity(models.Model):
-    activity_id = models.IntegerField(primary_key=True)
+    activity_id = models.BigIntegerField(primary_key=True)
     athlete = models.ForeignKey(Athlete, related_name='activities', on_delete=models.CASCADE)
     date = models.DateTimeField(blank=False, null=False)
     upload_date = models.DateTimeField(default=timezone.now)
+    # Last change of the activity or its points, which the activity feed is keyed on
+    updated_at = models.DateTimeField(default=timezone.now)
     distance = models.FloatField(blank=False, null=False)
     positive_elevation_gain = models.PositiveIntegerField(blank=False, null=False)
     negative_elevation_gain = models.PositiveIntegerField(blank=False, null=False)
     run_time = models.DurationField()
     avg_speed = models.FloatField()
+    discipline = models.ForeignKey(Discipline, null=True, related_name="activities", on_delete=models.SET_NULL)
+    points = models.FloatField(default=0)
 
     class Meta:
         ordering = ["upload_date"]
+        indexes = [models.Index(fields=['athlete', 'date'], name='activity_athlete_date_idx'),
+                   models.Index(fields=['athlete', 'updated_at'], name='activity_athlete_updated_idx')]
         verbose_name = "Activity"
         verbose_name_plural = "Activities"
 
+    def compute_points(self):
+        if self.discipline is None:
+            return 0
+        return self.discipline.compute_points(self.distance, self.positive_elevation_gain, self.run_time)
+
+    def save(self, *args, **kwargs):
+        self.points = self.compute_points()
+        if not self._state.adding:
+            self.updated_at = timezone.now()
+        with transaction.atomic():
+            previous = Activity.objects.select_for_update().filter(pk=self.pk).values_list('points', flat=True)
+            previous = previous.first() or 0
+            super().save(*args, **kwargs)
+            credit_points({self.athlete_id: self.points - previous})
+
+
+class ActivityDeletion(models.Model):
+    """Tombstone of a deleted activity, for the clients syncing the activity feed to remove it."""
+    activity_id = models.BigIntegerField()
+    # No constraint: the tombstones of an athlete's activities are written while the athlete is deleted.
+    athlete = models.ForeignKey(Athlete, related_name='activity_deletions', on_delete=models.DO_NOTHING,
+                                db_constraint=False)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "api_activity_deletion"
+        indexes = [models.Index(fields=['athlete', 'deleted_at'], name='deletion_athlete_date_idx')]
+        verbose_name = "Activity Deletion"
+        verbose_name_plural = "Activity Deletions"
+
+    def __str__(self):
+        return f"{self.activity_id} deleted at {self.deleted_at}"
+
 
 class StravaActivity(models.Model):
-    id = models.IntegerField(primary_key=True)
+    id = models.BigIntegerField(primary_key=True)
     name = models.CharField(max_length=500)
     type = models.CharField(max_length=50)
     distance = models.FloatField()
@@ -127,12 +224,63 @@ class StravaActivity(models.Model):
     total_elevation_gain = models.FloatField()
     start_date = models.DateTimeField()
     athlete = models.ForeignKey(Athlete, related_name="strava_activities", on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
         db_table = "api_strava_activity"
         ordering = ["start_date"]
+        indexes = [models.Index(fields=['athlete', 'start_date'], name='strava_athlete_start_idx')]
         verbose_name = "Strava Activity"
         verbose_name_plural = "Strava Activities"
 
     def __str__(self):
         return self.name
+
+
+class StravaSyncJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    SYNC = 'sync'
+    FETCH_ACTIVITY = 'fetch_activity'
+    DELETE_ACTIVITY = 'delete_activity'
+    DEAUTHORIZE = 'deauthorize'
+
+    athlete = models.ForeignKey(Athlete, related_name="strava_sync_jobs", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, default=SYNC, choices=[(SYNC, "sync"), (FETCH_ACTIVITY, "fetch activity"),
+                                                                  (DELETE_ACTIVITY, "delete activity"),
+                                                                  (DEAUTHORIZE, "deauthorize")])
+    activity_id = models.BigIntegerField(null=True)
+    status = models.CharField(max_length=20, default=PENDING, choices=[(PENDING, "pending"), (RUNNING, "running"),
+                                                                       (DONE, "done"), (FAILED, "failed")])
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # A failed job is retried, not before this date
+    not_before = models.DateTimeField(null=True)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        db_table = "api_strava_sync_job"
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=['status', 'created_at'], name='sync_job_status_created_idx')]
+        verbose_name = "Strava Sync Job"
+        verbose_name_plural = "Strava Sync Jobs"
+
+    def __str__(self):
+        return f"{self.athlete_id} {self.kind}: {self.status}"
+
+
+class Watermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Watermark"
+        verbose_name_plural = "Watermarks"
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,205 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.db.models import F, Q, Window
+from django.db.models.functions import Rank
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class RankingPagination(BasePagination):
+    """
+    Keyset pagination over a queryset annotated with a `total` score, ranked in SQL.
+
+    Rows are ordered by decreasing total then id. The cursor carries the last row of the previous page so each page
+    is a single indexed query, and the window rank computed on the remaining rows is shifted back to the global rank.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Relative, so that snapshots of the page do not depend on the host it was first requested from
+        self.base_url = request.get_full_path()
+        cursor = self.decode_cursor(request)
+        page = list(self.page_queryset(queryset, cursor))
+        has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+
+        seen = 0
+        if cursor is not None:
+            seen = cursor['seen']
+            for obj in page:
+                # Rows tied with the last row of the previous page share its rank.
+                obj.rank = cursor['rank'] if obj.total == cursor['total'] else obj.rank + seen
+        self.next_cursor = None
+        if has_next:
+            last = page[-1]
+            self.next_cursor = {'total': last.total, 'id': last.id, 'rank': last.rank, 'seen': seen + len(page)}
+        return page
+
+    def page_queryset(self, queryset, cursor):
+        """Return the query of the page following `cursor`, with one more row telling whether there is a next page."""
+        if cursor is not None:
+            queryset = queryset.filter(Q(total__lt=cursor['total']) | Q(total=cursor['total'], id__gt=cursor['id']))
+        queryset = queryset.annotate(rank=Window(Rank(), order_by=F('total').desc())).order_by('-total', 'id')
+        return queryset[:self.page_size + 1]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        encoded = base64.urlsafe_b64encode(json.dumps(self.next_cursor).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        return self.parse_cursor(request.query_params.get(self.cursor_query_param))
+
+    @classmethod
+    def parse_cursor(cls, encoded):
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            return {'total': float(cursor['total']), 'id': int(cursor['id']), 'rank': int(cursor['rank']),
+                    'seen': int(cursor['seen'])}
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(cls.invalid_cursor_message)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class OrderingCursorPagination(CursorPagination):
+    """
+    Cursor pagination following the ordering of the queryset, or the default ordering of its model.
+
+    The position is read from the first ordering field, which may span relations (e.g. `user__username`), and the
+    primary key breaks ties so that pages never overlap.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering += ('pk',)
+        return ordering
+
+    def decode_cursor(self, request):
+        if not request.query_params.get(self.cursor_query_param):
+            return None
+        return super().decode_cursor(request)
+
+    def _get_position_from_instance(self, instance, ordering):
+        value = instance
+        for attr in ordering[0].lstrip('-').split('__'):
+            value = value[attr] if isinstance(value, dict) else getattr(value, attr)
+        return str(value)
+
+
+class OptInCursorPagination(PageNumberPagination):
+    """
+    Page number pagination, switched to cursor pagination when the request has a `cursor` query parameter.
+
+    Pages of a cursor are a single query whatever their depth, without the `count`: clients start scrolling with an
+    empty `cursor` and follow the `next` links.
+    """
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if OrderingCursorPagination.cursor_query_param in request.query_params:
+            self.cursor_paginator = OrderingCursorPagination()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_fields(self, view):
+        return super().get_schema_fields(view) + OrderingCursorPagination().get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + \
+            OrderingCursorPagination().get_schema_operation_parameters(view)
+
+
+class ActivityFeedPagination(BasePagination):
+    """
+    Incremental feed of the activities changed and deleted after a sync token.
+
+    The token is the date and id of the last row sent. Activities are keyed on `updated_at`, which edits, Strava
+    updates and rescoring bump, and deleted ones leave a tombstone dated from their deletion, so clients polling with
+    the token of their last response only receive what changed.
+    """
+    page_size = 200
+    since_query_param = 'since'
+    invalid_token_message = 'Invalid sync token'
+
+    def paginate_queryset(self, queryset, request, view=None, deletions=None):
+        """Return the next rows of `queryset` by update date, merged with the `deletions` tombstones if given."""
+        self.since = request.query_params.get(self.since_query_param) or None
+        position = self.decode_token(self.since)
+        page = self.rows_after(queryset, 'updated_at', position)
+        if deletions is not None:
+            page = sorted(page + self.rows_after(deletions, 'deleted_at', position),
+                          key=lambda row: (row.feed_date, row.activity_id))
+        self.has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if page:
+            self.since = self.encode_token(page[-1])
+        return page
+
+    def rows_after(self, queryset, date_field, position):
+        queryset = queryset.annotate(feed_date=F(date_field))
+        if position is not None:
+            date, activity_id = position
+            queryset = queryset.filter(Q(**{f'{date_field}__gt': date}) |
+                                       Q(**{date_field: date, 'activity_id__gt': activity_id}))
+        return list(queryset.order_by(date_field, 'activity_id')[:self.page_size + 1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('since', self.since),
+            ('more', self.has_more),
+            ('results', data)
+        ]))
+
+    def encode_token(self, row):
+        token = {'updated_at': row.feed_date.isoformat(), 'id': row.activity_id}
+        return base64.urlsafe_b64encode(json.dumps(token).encode()).decode()
+
+    def decode_token(self, encoded):
+        if encoded is None:
+            return None
+        try:
+            token = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            return datetime.datetime.fromisoformat(token['updated_at']), int(token['id'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_token_message)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'since': {'type': 'string', 'nullable': True},
+                'more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
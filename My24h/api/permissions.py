@@ -0,0 +1,15 @@
+from django.contrib.auth import get_user_model
+from rest_framework.permissions import BasePermission
+
+
+class IsStaff(BasePermission):
+    """
+    Allow the organizers only.
+
+    Access tokens do not carry the staff status, which is checked against the database to take effect immediately.
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and
+                    get_user_model().objects.filter(id=user.id, is_staff=True, is_active=True).exists())
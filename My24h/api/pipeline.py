@@ -0,0 +1,100 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Activity, Discipline, StravaActivity, Watermark, credit_points
+
+WATERMARK = 'strava_activities'
+PROMOTED_FIELDS = ['athlete_id', 'date', 'updated_at', 'distance', 'positive_elevation_gain',
+                   'negative_elevation_gain', 'run_time', 'avg_speed', 'discipline_id', 'points']
+BATCH_SIZE = 500
+MIN_DATE = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+def strava_disciplines():
+    """Map the lowercased Strava activity types to the disciplines, matching by name when no type is set."""
+    disciplines = {}
+    for discipline in Discipline.objects.all():
+        disciplines.setdefault((discipline.strava_type or discipline.name).lower(), discipline)
+    return disciplines
+
+
+def to_activity(strava_activity, discipline):
+    seconds = strava_activity.moving_time.total_seconds()
+    now = timezone.now()
+    activity = Activity(
+        activity_id=strava_activity.id,
+        athlete_id=strava_activity.athlete_id,
+        date=strava_activity.start_date,
+        upload_date=now,
+        updated_at=now,
+        distance=strava_activity.distance,
+        positive_elevation_gain=round(strava_activity.total_elevation_gain),
+        negative_elevation_gain=0,
+        run_time=strava_activity.moving_time,
+        avg_speed=strava_activity.distance / seconds if seconds else 0,
+        discipline=discipline
+    )
+    activity.points = activity.compute_points()
+    return activity
+
+
+def is_unchanged(activity, previous):
+    return all(getattr(activity, field) == getattr(previous, field)
+               for field in PROMOTED_FIELDS if field != 'updated_at')
+
+
+def promote_strava_activities():
+    """
+    Create, update or delete the scored activities of the Strava activities changed since the last run.
+
+    Strava activities whose type maps to no discipline are not scored. The points deltas are credited to the
+    athletes and teams totals in the same transaction as the activities and the watermark. Returns the number of
+    scored activities created, updated or deleted.
+
+    `updated_at` is set before the ingesting transaction commits, so a Strava activity can become visible after a
+    run which moved the watermark past its date: each run scans STRAVA_PROMOTION_OVERLAP seconds before the
+    watermark again, skipping the activities whose score is already up to date.
+    """
+    with transaction.atomic():
+        watermark, _ = Watermark.objects.select_for_update().get_or_create(
+            name=WATERMARK, defaults={'value': MIN_DATE}
+        )
+        overlap = datetime.timedelta(seconds=settings.STRAVA_PROMOTION_OVERLAP)
+        since = watermark.value - overlap if watermark.value - MIN_DATE > overlap else MIN_DATE
+        changed = list(StravaActivity.objects.filter(updated_at__gt=since).order_by('updated_at'))
+        if not changed:
+            return 0
+        disciplines = strava_disciplines()
+        deltas = defaultdict(float)
+        promoted = 0
+        for start in range(0, len(changed), BATCH_SIZE):
+            batch = changed[start:start + BATCH_SIZE]
+            existing = Activity.objects.in_bulk([strava_activity.id for strava_activity in batch])
+            created, updated, deleted = [], [], []
+            for strava_activity in batch:
+                discipline = disciplines.get(strava_activity.type.lower())
+                previous = existing.get(strava_activity.id)
+                if discipline is None:
+                    if previous is not None:
+                        # Its points are debited when it is deleted.
+                        deleted.append(previous.activity_id)
+                    continue
+                activity = to_activity(strava_activity, discipline)
+                if previous is not None:
+                    if is_unchanged(activity, previous):
+                        continue
+                    deltas[previous.athlete_id] -= previous.points
+                deltas[activity.athlete_id] += activity.points
+                (created if previous is None else updated).append(activity)
+            Activity.objects.bulk_create(created)
+            Activity.objects.bulk_update(updated, PROMOTED_FIELDS)
+            Activity.objects.filter(activity_id__in=deleted).delete()
+            promoted += len(created) + len(updated) + len(deleted)
+        credit_points(deltas)
+        watermark.value = max(watermark.value, changed[-1].updated_at)
+        watermark.save()
+    return promoted
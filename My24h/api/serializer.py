@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Athlete, Category, Team, Discipline, RaceDiscipline, Race
-from rest_framework_simplejwt.serializers import TokenObtainSerializer, TokenRefreshSerializer
+from . import images
+from .models import Activity, ActivityDeletion, Athlete, Category, Team, Discipline, RaceDiscipline, Race, \
+    StravaActivity
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
@@ -12,11 +15,11 @@ from rest_framework_simplejwt.tokens import RefreshToken
 
 class AthleteLightSerializer(serializers.ModelSerializer):
     user = serializers.SlugRelatedField(many=False, read_only=True, slug_field='username')
-    point = serializers.IntegerField(read_only=True)
+    point = serializers.FloatField(source='points', read_only=True)
 
     class Meta:
         model = Athlete
-        fields = ['id', 'user', 'point']
+        fields = ['id', 'user', 'point', 'thumbnail', 'thumbnail_jpeg']
 
 
 class CategoryLightSerializer(serializers.ModelSerializer):
@@ -65,7 +68,7 @@ class RaceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Race
-        fields = ["id", "name", "disciplines"]
+        fields = ["id", "name", "start_date", "disciplines"]
 
 
 class TeamSerializer(serializers.ModelSerializer):
@@ -77,7 +80,7 @@ class TeamSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Team
-        fields = ['id', 'name', 'race', 'category', 'members', 'admins']
+        fields = ['id', 'name', 'race', 'category', 'thumbnail', 'thumbnail_jpeg', 'members', 'admins']
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -100,49 +103,100 @@ class AthleteSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Athlete
-        fields = ['id', 'user', 'image', 'birthday', 'team', 'strava_id', 'race']
+        fields = ['id', 'user', 'image', 'thumbnail', 'thumbnail_jpeg', 'birthday', 'team', 'strava_id', 'race']
+
+
+class PictureSerializer(serializers.Serializer):
+    image = serializers.ImageField(read_only=True)
+    thumbnail = serializers.ImageField(read_only=True)
+    thumbnail_jpeg = serializers.ImageField(read_only=True)
+    picture = serializers.ImageField(write_only=True)
+
+    def validate_picture(self, picture):
+        if picture.size > settings.PICTURE_MAX_SIZE:
+            raise serializers.ValidationError(f"The picture should not exceed {settings.PICTURE_MAX_SIZE} bytes.")
+        if picture.image.format not in images.FORMATS:
+            raise serializers.ValidationError(f"The picture should be in {', '.join(images.FORMATS)} format.")
+        width, height = picture.image.size
+        if width * height > settings.PICTURE_MAX_PIXELS:
+            raise serializers.ValidationError(f"The picture should not exceed {settings.PICTURE_MAX_PIXELS} pixels.")
+        return picture
+
+
+class StravaActivitySerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = StravaActivity
+        fields = ["id", "name", "type", "distance", "moving_time", "total_elevation_gain", "start_date"]
+
+
+class StravaEventSerializer(serializers.Serializer):
+    object_type = serializers.ChoiceField(choices=['activity', 'athlete'])
+    object_id = serializers.IntegerField()
+    aspect_type = serializers.ChoiceField(choices=['create', 'update', 'delete'])
+    owner_id = serializers.IntegerField()
+    subscription_id = serializers.IntegerField()
+    event_time = serializers.IntegerField(required=False)
+    updates = serializers.DictField(required=False, default=dict)
+
+    def validate_subscription_id(self, subscription_id):
+        if str(subscription_id) != settings.STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+            raise serializers.ValidationError("Unknown subscription.")
+        return subscription_id
+
+
+class ActivityFeedSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='activity_id')
+    deleted = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Activity
+        fields = ["id", "discipline", "date", "distance", "positive_elevation_gain", "run_time", "points", "deleted"]
+
+    def get_deleted(self, activity) -> bool:
+        return False
+
+
+class ActivityDeletionSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='activity_id')
+    deleted = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ActivityDeletion
+        fields = ["id", "deleted"]
+
+    def get_deleted(self, deletion) -> bool:
+        return True
 
 
 class TeamRankingSerializer(serializers.ModelSerializer):
-    points = serializers.SerializerMethodField()
-    race = RaceSerializer()
+    rank = serializers.IntegerField(read_only=True)
+    points = serializers.FloatField(source='total', read_only=True)
+    race = serializers.StringRelatedField(many=False)
     category = CategoryLightSerializer()
 
-    def get_points(self, obj):
-        team = Team.objects.get(id=obj.pk)
-        team_activities = team.members.activities.all()
-        points = 0
-        for activity in team_activities:
-            points += activity.point
-        return points
-
     class Meta:
         model = Team
-        fields = ["id", "name", "race", "category", "points"]
+        fields = ["id", "rank", "name", "race", "category", "points"]
 
 
 class AthleteRankingSerializer(serializers.ModelSerializer):
-    points = serializers.SerializerMethodField()
-
-    def get_points(self, obj):
-        athlete = Athlete.objects.get(id=obj.id)
-        activities = athlete.activities.all()
-        points = 0
-        for activity in activities:
-            points += activity.point
-        return points
+    rank = serializers.IntegerField(read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    points = serializers.FloatField(source='total', read_only=True)
 
     class Meta:
         model = Athlete
-        fields = ["id", "username", "points"]
+        fields = ["id", "rank", "username", "points"]
 
 
-class CustomTokenObtainPairSerializer(TokenObtainSerializer):
+class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
     @classmethod
-    def get_token(cls, user):
+    def get_token(cls, user, athlete=None):
         token = super().get_token(user)
         token['name'] = user.username
+        set_athlete_claims(token, athlete or Athlete.objects.filter(user=user).first())
         return token
 
     def validate(self, attrs):
@@ -152,10 +206,17 @@ class CustomTokenObtainPairSerializer(TokenObtainSerializer):
         return data
 
 
+def set_athlete_claims(token, athlete):
+    """Add the athlete and his/her teams to the token, so that requests do not need to look them up."""
+    token['athlete_id'] = athlete.id if athlete else None
+    token['team_id'] = athlete.team_id if athlete else None
+    token['admin_team_id'] = athlete.admin_id if athlete else None
+
+
 class CustomTokenRefreshSerializer(TokenRefreshSerializer):
 
     def validate(self, attrs):
         data = super().validate(attrs)
         refresh = RefreshToken(attrs['refresh'])
-        data['lifetime'] = int(refresh.access_token.lifetime.total_seconds)
+        data['lifetime'] = int(refresh.access_token.lifetime.total_seconds())
         return data
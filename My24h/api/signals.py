@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .models import Activity, ActivityDeletion, Category, Discipline, Race, RaceDiscipline, credit_points
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Discipline)
+@receiver([post_save, post_delete], sender=Race)
+@receiver([post_save, post_delete], sender=RaceDiscipline)
+def invalidate_reference_data(sender, **kwargs):
+    bump_version('reference')
+
+
+@receiver(post_delete, sender=Activity)
+def debit_deleted_activity(sender, instance, **kwargs):
+    """Remove the points of deleted activities from the totals, whether deleted one by one, in bulk or by cascade."""
+    credit_points({instance.athlete_id: -instance.points})
+
+
+@receiver(post_delete, sender=Activity)
+def record_activity_deletion(sender, instance, **kwargs):
+    ActivityDeletion.objects.create(activity_id=instance.activity_id, athlete_id=instance.athlete_id)
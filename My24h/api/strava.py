@@ -0,0 +1,177 @@
+import datetime
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+TIMEOUT = 10
+PER_PAGE = 200
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        # Seconds until the quota is renewed
+        self.retry_after = retry_after
+
+
+class RateLimit:
+    """
+    Strava rate limits, as reported by the `X-RateLimit-Limit` and `X-RateLimit-Usage` headers of its responses.
+
+    Strava allows a number of requests per 15 minutes window (starting at 0, 15, 30 and 45 past the hour) and per
+    UTC day. Requests are counted here as they are sent so that concurrent threads do not overshoot the quota: when
+    the short term quota is spent `acquire` waits for the next window, unless not `block`ing, when the daily one is
+    spent it raises.
+    """
+    WINDOW = 15 * 60
+    DAY = 24 * 60 * 60
+
+    def __init__(self, sleep=time.sleep, clock=time.time):
+        self.sleep = sleep
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.limits = None
+        self.usage = [0, 0]
+        self.updated_at = 0
+
+    def _reset_windows(self, now):
+        if now // self.DAY != self.updated_at // self.DAY:
+            self.usage = [0, 0]
+        elif now // self.WINDOW != self.updated_at // self.WINDOW:
+            self.usage[0] = 0
+        self.updated_at = now
+
+    def acquire(self, block=True):
+        while True:
+            with self.lock:
+                if self.limits is None:
+                    return
+                now = self.clock()
+                self._reset_windows(now)
+                if self.usage[1] >= self.limits[1]:
+                    raise RateLimitExceeded("Strava daily rate limit reached", self.DAY - now % self.DAY)
+                if self.usage[0] < self.limits[0]:
+                    self.usage = [self.usage[0] + 1, self.usage[1] + 1]
+                    return
+                delay = self.WINDOW - now % self.WINDOW
+            if not block:
+                raise RateLimitExceeded("Strava rate limit reached", delay)
+            self.sleep(delay)
+
+    def update(self, headers):
+        try:
+            limits = [int(value) for value in headers["X-RateLimit-Limit"].split(",")[:2]]
+            usage = [int(value) for value in headers["X-RateLimit-Usage"].split(",")[:2]]
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            self.limits = limits
+            self.usage = usage
+            self.updated_at = self.clock()
+
+    def exhaust(self):
+        with self.lock:
+            if self.limits is not None:
+                self.usage[0] = self.limits[0]
+
+
+class StravaClient:
+    """
+    Strava API client sharing a pool of keep-alive connections between threads.
+
+    Unless `block`, requests raise RateLimitExceeded instead of waiting for the rate limit window, so that web
+    requests are not held for minutes.
+    """
+
+    def __init__(self, pool_size=10, rate_limit=None, block=True):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limit = rate_limit or RateLimit()
+        self.block = block
+
+    def request(self, method, url, **kwargs):
+        for attempt in range(2):
+            self.rate_limit.acquire(self.block)
+            response = self.session.request(method, url, timeout=TIMEOUT, **kwargs)
+            self.rate_limit.update(response.headers)
+            if response.status_code != 429:
+                break
+            # Our own accounting drifted from Strava's: wait for the next window and try once more.
+            self.rate_limit.exhaust()
+            if not self.block:
+                now = self.rate_limit.clock()
+                raise RateLimitExceeded("Strava rate limit reached", RateLimit.WINDOW - now % RateLimit.WINDOW)
+        response.raise_for_status()
+        return response.json()
+
+    def exchange_token(self, authorization_code):
+        return self.request("POST", settings.STRAVA_OAUTH_URL, data={
+            "client_id": settings.STRAVA_CLIENT_ID,
+            "client_secret": settings.STRAVA_CLIENT_SECRET,
+            "code": authorization_code,
+            "grant_type": "authorization_code"
+        })
+
+    def refresh_token(self, token):
+        return self.request("POST", settings.STRAVA_OAUTH_URL, data={
+            "client_id": settings.STRAVA_CLIENT_ID,
+            "client_secret": settings.STRAVA_CLIENT_SECRET,
+            "grant_type": "refresh_token",
+            "refresh_token": token
+        })
+
+    def get_activity(self, access_token, activity_id):
+        return self.request("GET", f"{settings.STRAVA_API_URL}/activities/{activity_id}",
+                            headers={"Authorization": "Bearer " + access_token})
+
+    def list_activities(self, access_token, after, before, per_page=None):
+        """Return all the activities started between the `after` and `before` epochs, following the pages."""
+        per_page = per_page or PER_PAGE
+        activities = []
+        page = 1
+        while True:
+            data = self.request("GET", f"{settings.STRAVA_API_URL}/athlete/activities",
+                                headers={"Authorization": "Bearer " + access_token},
+                                params={"after": after, "before": before, "page": page, "per_page": per_page})
+            activities += data
+            if len(data) < per_page:
+                return activities
+            page += 1
+
+
+_clients = {}
+_client_lock = threading.Lock()
+_rate_limit = RateLimit()
+
+
+def get_client(block=True):
+    """Return the blocking or non-blocking client shared by the whole process, both counting the same requests."""
+    with _client_lock:
+        if block not in _clients:
+            _clients[block] = StravaClient(pool_size=settings.STRAVA_SYNC_WORKERS, rate_limit=_rate_limit, block=block)
+        return _clients[block]
+
+
+def race_window(athlete):
+    """Return the `after` and `before` epochs of the athlete's race, or the configured defaults."""
+    race = athlete.race
+    if race is None or race.start_date is None:
+        return settings.STRAVA_ACTIVITIES_AFTER, settings.STRAVA_ACTIVITIES_BEFORE
+    durations = [discipline.duration for discipline in race.disciplines.all()]
+    end = race.start_date + max(durations, default=datetime.timedelta(hours=24))
+    return int(race.start_date.timestamp()), int(end.timestamp())
+
+
+def set_tokens(athlete, data):
+    """Copy the tokens of a Strava OAuth response on the athlete, without saving it."""
+    athlete.access_token = data.get("access_token")
+    athlete.access_token_expiration_date = datetime.datetime.fromtimestamp(data.get("expires_at"),
+                                                                           tz=datetime.timezone.utc)
+    athlete.refresh_token = data.get("refresh_token")
+    if data.get("athlete"):
+        athlete.strava_id = data["athlete"].get("id")
@@ -0,0 +1,268 @@
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import strava
+from .models import Activity, Athlete, StravaActivity, StravaSyncJob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = [StravaSyncJob.PENDING, StravaSyncJob.RUNNING]
+INGESTED_FIELDS = ['name', 'type', 'distance', 'moving_time', 'total_elevation_gain', 'start_date', 'athlete_id']
+BATCH_SIZE = 500
+
+
+class FetchError(Exception):
+    """A Strava request failed after the athlete's access token was refreshed, so the new tokens must still be saved."""
+
+    def __init__(self, tokens):
+        super().__init__("Strava request failed after refreshing the access token")
+        self.tokens = tokens
+
+
+def enqueue(athlete):
+    """Queue a synchronization job for the athlete unless one is already waiting or running."""
+    if not StravaSyncJob.objects.filter(athlete=athlete, kind=StravaSyncJob.SYNC, status__in=ACTIVE).exists():
+        StravaSyncJob.objects.create(athlete=athlete)
+
+
+def enqueue_event(event):
+    """
+    Queue the job answering a validated Strava webhook event, or return None when the event is ignored.
+
+    Activity creations and updates fetch this single activity, deletions remove it, and athletes revoking our
+    access get their tokens cleared. Events are not signed: deletions and deauthorizations are only applied once
+    confirmed by the Strava API.
+    """
+    athlete_id = Athlete.objects.filter(strava_id=event["owner_id"]).values_list('id', flat=True).first()
+    if athlete_id is None:
+        return None
+    if event["object_type"] == "activity":
+        kind = StravaSyncJob.DELETE_ACTIVITY if event["aspect_type"] == "delete" else StravaSyncJob.FETCH_ACTIVITY
+        return StravaSyncJob.objects.create(athlete_id=athlete_id, kind=kind, activity_id=event["object_id"])
+    if event["object_type"] == "athlete" and event["updates"].get("authorized") == "false":
+        return StravaSyncJob.objects.create(athlete_id=athlete_id, kind=StravaSyncJob.DEAUTHORIZE)
+    return None
+
+
+def enqueue_stale_athletes():
+    """Queue a synchronization job for every Strava connected athlete not synchronized for a while."""
+    threshold = timezone.now() - datetime.timedelta(seconds=settings.STRAVA_SYNC_INTERVAL)
+    athletes = Athlete.objects.filter(access_token__isnull=False) \
+        .filter(Q(last_update__isnull=True) | Q(last_update__lt=threshold)) \
+        .exclude(id__in=StravaSyncJob.objects.filter(kind=StravaSyncJob.SYNC, status__in=ACTIVE).values('athlete_id')) \
+        .values_list('id', flat=True)
+    return len(StravaSyncJob.objects.bulk_create([StravaSyncJob(athlete_id=athlete_id) for athlete_id in athletes]))
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` pending jobs as running and return them, skipping the ones claimed by another worker."""
+    lost = timezone.now() - datetime.timedelta(seconds=settings.STRAVA_SYNC_JOB_TIMEOUT)
+    StravaSyncJob.objects.filter(status=StravaSyncJob.RUNNING, started_at__lt=lost).update(status=StravaSyncJob.PENDING)
+    claimed = []
+    jobs = StravaSyncJob.objects.filter(status=StravaSyncJob.PENDING) \
+        .filter(Q(not_before__isnull=True) | Q(not_before__lte=timezone.now())) \
+        .select_related('athlete__race').prefetch_related('athlete__race__disciplines')
+    for job in jobs[:limit]:
+        job.started_at = timezone.now()
+        if StravaSyncJob.objects.filter(pk=job.pk, status=StravaSyncJob.PENDING).update(
+                status=StravaSyncJob.RUNNING, started_at=job.started_at, attempts=F('attempts') + 1):
+            job.attempts += 1
+            claimed.append(job)
+    return claimed
+
+
+def fetch_job(client, job, window):
+    """
+    Download the activities the job needs, refreshing the athlete's access token first if it expired.
+
+    Only performs HTTP calls so it can run in a worker thread; returns the new tokens (or None) and the activities
+    started within the `window` epochs. Deleted activities and revoked accesses are checked against Strava, as
+    webhook events could be forged: the activities are None when Strava no longer knows the activity, and the
+    tokens are None when a deauthorization is confirmed by a failing token refresh. Errors raised once the token
+    was refreshed are chained to a FetchError carrying the new tokens.
+    """
+    athlete = job.athlete
+    if job.kind == StravaSyncJob.DEAUTHORIZE:
+        try:
+            return client.refresh_token(athlete.refresh_token), []
+        except requests.HTTPError as e:
+            if e.response.status_code in (400, 401):
+                return None, []
+            raise
+    tokens = None
+    access_token = athlete.access_token
+    if athlete.access_token_expiration_date is None or athlete.access_token_expiration_date <= timezone.now():
+        tokens = client.refresh_token(athlete.refresh_token)
+        access_token = tokens["access_token"]
+    try:
+        return tokens, fetch_activities(client, job, access_token, window)
+    except Exception as e:
+        if tokens is None:
+            raise
+        raise FetchError(tokens) from e
+
+
+def fetch_activities(client, job, access_token, window):
+    if job.kind in (StravaSyncJob.FETCH_ACTIVITY, StravaSyncJob.DELETE_ACTIVITY):
+        try:
+            activity = client.get_activity(access_token, job.activity_id)
+        except requests.HTTPError as e:
+            if job.kind == StravaSyncJob.DELETE_ACTIVITY and e.response.status_code == 404:
+                return None
+            raise
+        if activity["athlete"]["id"] != job.athlete.strava_id:
+            # The event named an activity of another athlete, which the athlete's token can read if it is public.
+            logger.warning("Strava activity %s does not belong to athlete %s", job.activity_id, job.athlete_id)
+            return []
+        after, before = window
+        return [activity] if after <= parse_date(activity["start_date"]).timestamp() < before else []
+    return client.list_activities(access_token, *window)
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+
+
+def parse_activity(data, athlete):
+    return StravaActivity(
+        id=data["id"],
+        name=data.get("name", ""),
+        type=data.get("type", ""),
+        distance=data.get("distance") or 0,
+        moving_time=datetime.timedelta(seconds=data.get("moving_time") or 0),
+        total_elevation_gain=data.get("total_elevation_gain") or 0,
+        start_date=parse_date(data["start_date"]),
+        athlete=athlete
+    )
+
+
+def ingest_activities(athlete, activities):
+    """
+    Insert the new activities and update the changed ones with a fixed number of queries, whatever their number.
+
+    Returns the created and the updated activities; activities seen before and unchanged are skipped, which makes
+    synchronizing the same activities again a no-op.
+    """
+    parsed = {activity.id: activity for activity in (parse_activity(data, athlete) for data in activities)}
+    existing = StravaActivity.objects.in_bulk(list(parsed))
+    created = [activity for pk, activity in parsed.items() if pk not in existing]
+    updated = [activity for pk, activity in parsed.items()
+               if pk in existing and any(getattr(activity, field) != getattr(existing[pk], field)
+                                         for field in INGESTED_FIELDS)]
+    for activity in updated:
+        activity.updated_at = timezone.now()
+    with transaction.atomic():
+        StravaActivity.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        StravaActivity.objects.bulk_update(updated, INGESTED_FIELDS + ['updated_at'], batch_size=BATCH_SIZE)
+    return created, updated
+
+
+def save_job(job, tokens, activities):
+    athlete = job.athlete
+    with transaction.atomic():
+        if job.kind == StravaSyncJob.DEAUTHORIZE and tokens is None:
+            athlete.access_token = athlete.access_token_expiration_date = athlete.refresh_token = None
+            athlete.save(update_fields=['access_token', 'access_token_expiration_date', 'refresh_token'])
+            return
+        if job.kind == StravaSyncJob.DELETE_ACTIVITY and activities is None:
+            for activity in Activity.objects.filter(activity_id=job.activity_id, athlete=athlete):
+                activity.delete()
+            StravaActivity.objects.filter(id=job.activity_id, athlete=athlete).delete()
+            return
+        fields = []
+        if tokens is not None:
+            strava.set_tokens(athlete, tokens)
+            fields += ['access_token', 'access_token_expiration_date', 'refresh_token', 'strava_id']
+        ingest_activities(athlete, activities)
+        if job.kind == StravaSyncJob.SYNC:
+            athlete.last_update = timezone.now()
+            fields.append('last_update')
+        if fields:
+            athlete.save(update_fields=fields)
+
+
+def run_jobs(limit, workers, client=None):
+    """
+    Claim up to `limit` pending jobs and process them.
+
+    Strava is queried concurrently by a pool of `workers` threads while the results are written to the database
+    from the calling thread, one transaction per athlete.
+    """
+    client = client or strava.get_client()
+    jobs = claim_jobs(limit)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_job, client, job, strava.race_window(job.athlete)): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                save_job(job, *future.result())
+                job.status, job.error = StravaSyncJob.DONE, ""
+            except Exception as e:
+                logger.exception("Strava %s job of athlete %s failed", job.kind, job.athlete_id)
+                if isinstance(e, FetchError):
+                    # Strava rotates the refresh tokens: the one used to refresh may already be invalid.
+                    strava.set_tokens(job.athlete, e.tokens)
+                    job.athlete.save(update_fields=['access_token', 'access_token_expiration_date',
+                                                    'refresh_token', 'strava_id'])
+                    e = e.__cause__
+                job.error = repr(e)
+                retry(job)
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error', 'finished_at', 'not_before'])
+    return jobs
+
+
+def retry(job):
+    """
+    Queue a failed job again after an exponential delay, or mark it failed after STRAVA_SYNC_MAX_ATTEMPTS.
+
+    The job stays active meanwhile, so that the athlete is not queued again by `enqueue_stale_athletes` and an
+    athlete whose synchronization keeps failing is retried less and less often.
+    """
+    if job.attempts >= settings.STRAVA_SYNC_MAX_ATTEMPTS:
+        job.status = StravaSyncJob.FAILED
+        return
+    delay = settings.STRAVA_SYNC_RETRY_DELAY * 2 ** (job.attempts - 1)
+    job.status, job.not_before = StravaSyncJob.PENDING, timezone.now() + datetime.timedelta(seconds=delay)
+
+
+def refresh_expiring_tokens(client, within, batch_size, workers):
+    """
+    Refresh the Strava access tokens expiring in the next `within` seconds, before a request or job needs them.
+
+    Athletes are processed in batches of `batch_size`: tokens are refreshed concurrently by `workers` threads and
+    saved with one bulk update per batch. The tokens Strava rejects are cleared. Returns the number of refreshed and
+    failed athletes.
+    """
+    threshold = timezone.now() + datetime.timedelta(seconds=within)
+    ids = list(Athlete.objects.filter(refresh_token__isnull=False, access_token_expiration_date__lte=threshold)
+               .order_by('access_token_expiration_date').values_list('id', flat=True))
+    refreshed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(ids), batch_size):
+            athletes = Athlete.objects.filter(id__in=ids[start:start + batch_size]).only('id', 'refresh_token')
+            futures = {executor.submit(client.refresh_token, athlete.refresh_token): athlete for athlete in athletes}
+            updated = []
+            for future in as_completed(futures):
+                athlete = futures[future]
+                try:
+                    strava.set_tokens(athlete, future.result())
+                    refreshed += 1
+                except Exception as e:
+                    failed += 1
+                    if not isinstance(e, requests.HTTPError) or e.response.status_code not in (400, 401):
+                        logger.exception("Strava token refresh of athlete %s failed", athlete.id)
+                        continue
+                    # The athlete revoked our access: clear the tokens as a deauthorization does, not to retry forever.
+                    logger.warning("Strava refresh token of athlete %s was revoked", athlete.id)
+                    athlete.access_token = athlete.access_token_expiration_date = athlete.refresh_token = None
+                updated.append(athlete)
+            Athlete.objects.bulk_update(updated, ['access_token', 'access_token_expiration_date', 'refresh_token'])
+    return refreshed, failed
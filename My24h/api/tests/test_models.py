@@ -0,0 +1,219 @@
+import datetime
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.db.utils import DataError, OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from api.db.pool import ConnectionPool, PoolTimeout
+from api.management.commands import import_athletes
+from api.models import Activity, Athlete, Category, Discipline, Race, Team
+
+
+class PointsLedgerTestCase(TestCase):
+
+    def setUp(self):
+        self.race = Race.objects.create(name="24h")
+        self.category = Category.objects.create(name="Duo", label="Duo", max_participants=2)
+        self.discipline = Discipline.objects.create(name="Run", points_per_km=10, elevation_gain_coeff=0.5,
+                                                    duration_coeff=2)
+        self.team = Team.objects.create(name="Team", join_code="code", race=self.race, category=self.category)
+        user = User.objects.create_user(username="runner", password="password")
+        self.athlete = Athlete.objects.create(user=user, gender="female", birthday=datetime.date(2000, 1, 1),
+                                              race=self.race, team=self.team)
+
+    def create_activity(self, activity_id, distance):
+        return Activity.objects.create(activity_id=activity_id, athlete=self.athlete, discipline=self.discipline,
+                                       date=datetime.datetime(2022, 4, 23, tzinfo=datetime.timezone.utc),
+                                       distance=distance, positive_elevation_gain=10, negative_elevation_gain=10,
+                                       run_time=datetime.timedelta(hours=1), avg_speed=10)
+
+    def test_activity_points(self):
+        activity = self.create_activity(1, 10000)
+        self.assertEqual(activity.points, 10 * 10 + 10 * 0.5 + 2)
+
+    def test_totals_follow_activity_writes(self):
+        activity = self.create_activity(1, 10000)
+        self.create_activity(2, 5000)
+        activity.distance = 20000
+        activity.save()
+        self.athlete.refresh_from_db()
+        self.team.refresh_from_db()
+        self.assertEqual(self.athlete.points, 207 + 57)
+        self.assertEqual(self.team.points, 207 + 57)
+        activity.delete()
+        self.athlete.refresh_from_db()
+        self.assertEqual(self.athlete.points, 57)
+
+    def test_totals_follow_bulk_delete(self):
+        self.create_activity(1, 10000)
+        self.create_activity(2, 5000)
+        self.create_activity(3, 5000)
+        Activity.objects.filter(activity_id__in=[1, 2]).delete()
+        self.athlete.refresh_from_db()
+        self.team.refresh_from_db()
+        self.assertEqual(self.athlete.points, 57)
+        self.assertEqual(self.team.points, 57)
+
+    def test_totals_follow_team_change(self):
+        self.create_activity(1, 10000)
+        other = Team.objects.create(name="Other", join_code="code", race=self.race, category=self.category)
+        athlete = Athlete.objects.get(id=self.athlete.id)
+        athlete.team = other
+        athlete.save()
+        self.team.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.team.points, 0)
+        self.assertEqual(other.points, 107)
+
+    def test_stale_save_keeps_totals_consistent(self):
+        self.create_activity(1, 10000)
+        other = Team.objects.create(name="Other", join_code="code", race=self.race, category=self.category)
+        stale = Athlete.objects.get(id=self.athlete.id)
+        moved = Athlete.objects.get(id=self.athlete.id)
+        moved.team = other
+        moved.save(update_fields=['team'])
+        self.create_activity(2, 5000)
+
+        # Saved with its stale team: the points follow the team read from the database, and are not overwritten.
+        stale.city = "Le Mans"
+        stale.save()
+        self.assertEqual(Athlete.objects.get(id=self.athlete.id).points, 107 + 57)
+        self.assertEqual(Team.objects.get(id=self.team.id).points, 107 + 57)
+        self.assertEqual(Team.objects.get(id=other.id).points, 0)
+
+
+class ExplainQueriesTestCase(TestCase):
+
+    def test_key_queries_use_indexes(self):
+        call_command('explain_queries', stdout=io.StringIO())
+
+    def test_full_scan_fails(self):
+        queries = {'athletes by city': Athlete.objects.filter(city="Le Mans").order_by()}
+        with mock.patch('api.management.commands.explain_queries.key_queries', return_value=queries):
+            with self.assertRaisesMessage(CommandError, "athletes by city"):
+                call_command('explain_queries', stdout=io.StringIO())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ImportAthletesTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.race = Race.objects.create(name="24h")
+        User.objects.create_user(username="taken", password="password")
+
+    def registration(self, username, **fields):
+        return {"username": username, "first_name": "First", "last_name": "Last", "email": f"{username}@insa.fr",
+                "password": "secret", "birthdate": "2000-01-01", "gender": "female", "address": "1 rue",
+                "zip_code": "72000", "city": "Le Mans", "race_id": self.race.id, **fields}
+
+    def import_file(self, content, suffix):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"athletes{suffix}")
+            report = os.path.join(directory, "report.csv")
+            with open(path, 'w') as file:
+                file.write(content)
+            call_command('import_athletes', path, report=report, batch_size=2, workers=2, stdout=io.StringIO())
+            with open(report) as file:
+                return file.read().splitlines()[1:]
+
+    def test_import_csv(self):
+        rows = [self.registration(f"runner{index}") for index in range(3)]
+        rows += [self.registration("taken"), self.registration("runner0"), self.registration("bad", gender="x")]
+        header = list(rows[0])
+        content = "\n".join([",".join(header)] + [",".join(str(row[key]) for key in header) for row in rows])
+        report = self.import_file(content, ".csv")
+        self.assertEqual(report, ["5,taken,username is already used", "6,runner0,username is already used",
+                                  "7,bad,\"gender should be one of female, male, unknown\""])
+        athletes = Athlete.objects.select_related('user').filter(user__username__startswith="runner")
+        self.assertEqual(len(athletes), 3)
+        self.assertTrue(athletes[0].user.check_password("secret"))
+        self.assertEqual(athletes[0].race, self.race)
+
+    def test_import_jsonl(self):
+        lines = [json.dumps(self.registration("runner")), "[1]", json.dumps(self.registration("late", race_id=0))]
+        report = self.import_file("\n".join(lines), ".jsonl")
+        self.assertEqual(report, ["2,,not a JSON object", "3,late,race 0 does not exist"])
+        self.assertTrue(Athlete.objects.filter(user__username="runner").exists())
+
+    def test_import_rejects_invalid_fields(self):
+        lines = [json.dumps(self.registration("mail", email="not an email")),
+                 json.dumps(self.registration("long", city="x" * 101, phone="0" * 21)),
+                 json.dumps(self.registration("u" * 151))]
+        report = self.import_file("\n".join(lines), ".jsonl")
+        self.assertEqual(report, ["1,mail,email is not valid", "2,long,city is too long; phone is too long",
+                                  f"3,{'u' * 151},username is too long"])
+        self.assertFalse(Athlete.objects.exists())
+
+    def test_database_errors_are_reported(self):
+        rows = [(1, self.registration("runner")), (2, self.registration("broken"))]
+        create_athletes = import_athletes.create_athletes
+
+        def fail_on_broken(rows, passwords):
+            if any(row["username"] == "broken" for row in rows):
+                raise DataError("Data too long for column")
+            create_athletes(rows, passwords)
+
+        with mock.patch.object(import_athletes, 'create_athletes', side_effect=fail_on_broken):
+            results = import_athletes.Command().insert(rows, ["password"] * 2)
+        self.assertEqual([error for _, error in results], [None, "Data too long for column"])
+        self.assertTrue(Athlete.objects.filter(user__username="runner").exists())
+
+
+class StartupTestCase(TestCase):
+
+    def test_startup_skips_unchanged_steps(self):
+        with tempfile.TemporaryDirectory() as static_root, override_settings(STATIC_ROOT=static_root):
+            output = io.StringIO()
+            call_command('startup', stdout=output)
+            self.assertIn("migrate: up to date", output.getvalue())
+            self.assertIn("collectstatic: collected", output.getvalue())
+            self.assertTrue(os.path.exists(os.path.join(static_root, 'admin', 'css', 'base.css')))
+            output = io.StringIO()
+            call_command('startup', stdout=output)
+            self.assertIn("collectstatic: unchanged", output.getvalue())
+
+    def test_wait_for_database(self):
+        connection = connections['default']
+        with mock.patch.object(connection, 'ensure_connection', side_effect=[OperationalError("down"), None]), \
+                mock.patch('time.sleep') as sleep:
+            call_command('w8_4_db', stdout=io.StringIO())
+        sleep.assert_called_once_with(0.1)
+        with mock.patch.object(connection, 'ensure_connection', side_effect=OperationalError("down")), \
+                mock.patch('time.sleep'):
+            with self.assertRaisesMessage(CommandError, "unavailable after 0s: down"):
+                call_command('w8_4_db', timeout=0, stdout=io.StringIO())
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+
+    def test_reuse_and_limit(self):
+        pool = ConnectionPool(max_size=2, timeout=0.01)
+        first, second = pool.acquire(mock.Mock), pool.acquire(mock.Mock)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(mock.Mock)
+        pool.release(second)
+        self.assertIs(pool.acquire(mock.Mock), second)
+        pool.release(first, reusable=False)
+        first.close.assert_called_once()
+        self.assertIsNot(pool.acquire(mock.Mock), first)
+
+    def test_broken_and_idle_connections_are_closed(self):
+        pool = ConnectionPool(min_size=1, max_idle=-1, check=lambda connection: connection.usable)
+        connections = [pool.acquire(mock.Mock) for _ in range(3)]
+        for connection in connections:
+            pool.release(connection)
+        # Connections idle for too long are closed, down to the minimum size.
+        connections[0].close.assert_called_once()
+        connections[1].close.assert_called_once()
+        connections[2].close.assert_not_called()
+        connections[2].usable = False
+        self.assertNotIn(pool.acquire(mock.Mock), connections)
+        connections[2].close.assert_called_once()
@@ -0,0 +1,358 @@
+import datetime
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api import pipeline, sync
+from api.models import (Activity, Athlete, Category, Discipline, Race, RaceDiscipline, StravaActivity, StravaSyncJob,
+                        Team)
+from api.strava import RateLimit, RateLimitExceeded, StravaClient
+
+
+class FakeStrava(BaseHTTPRequestHandler):
+    """Minimal Strava API: activities are keyed by access token, any refresh token not revoked is accepted."""
+    activities = {}
+    revoked = set()
+    requests = []
+    rate_limit_usage = "0,0"
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-RateLimit-Limit', '600,30000')
+        self.send_header('X-RateLimit-Usage', self.rate_limit_usage)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.requests.append(('GET', url.path, parse_qs(url.query)))
+        token = self.headers.get('Authorization', '')[len('Bearer '):]
+        if url.path == '/api/v3/athlete/activities' and token in self.activities:
+            query = parse_qs(url.query)
+            page, per_page = int(query['page'][0]), int(query['per_page'][0])
+            return self.send_json(self.activities[token][(page - 1) * per_page:page * per_page])
+        if url.path.startswith('/api/v3/activities/') and token in self.activities:
+            activity_id = int(url.path.rsplit('/', 1)[1])
+            for activity in self.activities[token]:
+                if activity['id'] == activity_id:
+                    return self.send_json(activity)
+            return self.send_json({'message': 'Record Not Found'}, status=404)
+        self.send_json({'message': 'Authorization Error'}, status=401)
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.requests.append(('POST', self.path, form))
+        if self.path == '/oauth/token' and form.get('grant_type') == ['refresh_token'] \
+                and form['refresh_token'][0] not in self.revoked:
+            return self.send_json({'access_token': f"fresh-{form['refresh_token'][0]}",
+                                   'refresh_token': form['refresh_token'][0],
+                                   'expires_at': int(timezone.now().timestamp()) + 21600})
+        self.send_json({'message': 'Bad Request'}, status=400)
+
+    def log_message(self, *args):
+        pass
+
+
+def strava_activity(activity_id, **kwargs):
+    return dict({'id': activity_id, 'name': f"Activity {activity_id}", 'type': 'Run', 'distance': 10000.0,
+                 'moving_time': 3600, 'total_elevation_gain': 50.0, 'start_date': '2021-04-22T10:00:00Z'}, **kwargs)
+
+
+class StravaSyncTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStrava)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{cls.server.server_port}'
+        cls.settings = override_settings(STRAVA_API_URL=f'{url}/api/v3', STRAVA_OAUTH_URL=f'{url}/oauth/token')
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeStrava.activities, FakeStrava.requests, FakeStrava.rate_limit_usage = {}, [], "0,0"
+        FakeStrava.revoked = set()
+        self.athletes = []
+        in_an_hour = timezone.now() + datetime.timedelta(hours=1)
+        for index in range(4):
+            user = User.objects.create_user(username=f"athlete{index}", password="password")
+            self.athletes.append(Athlete.objects.create(
+                user=user, gender="unknown", birthday=datetime.date(2000, 1, 1), access_token=f"token{index}",
+                refresh_token=f"refresh{index}", access_token_expiration_date=in_an_hour
+            ))
+            FakeStrava.activities[f"token{index}"] = [strava_activity(index * 10 + n) for n in range(3)]
+
+    def test_sync_stale_athletes(self):
+        expired = self.athletes[0]
+        expired.access_token_expiration_date = timezone.now()
+        expired.save()
+        FakeStrava.activities["fresh-refresh0"] = FakeStrava.activities.pop("token0")
+        up_to_date = self.athletes[1]
+        up_to_date.last_update = timezone.now()
+        up_to_date.save()
+
+        call_command('strava_sync', workers=2, stdout=io.StringIO())
+
+        self.assertEqual(StravaActivity.objects.count(), 9)
+        self.assertFalse(StravaActivity.objects.filter(athlete=up_to_date).exists())
+        self.assertEqual(StravaSyncJob.objects.filter(status=StravaSyncJob.DONE).count(), 3)
+        expired.refresh_from_db()
+        self.assertEqual(expired.access_token, "fresh-refresh0")
+        self.assertIsNotNone(expired.last_update)
+
+    def test_resync_is_idempotent(self):
+        call_command('strava_sync', stdout=io.StringIO())
+        Athlete.objects.update(last_update=None)
+        FakeStrava.activities["token2"][0]["name"] = "Renamed"
+        call_command('strava_sync', stdout=io.StringIO())
+        self.assertEqual(StravaActivity.objects.count(), 12)
+        self.assertEqual(StravaActivity.objects.get(id=20).name, "Renamed")
+        self.assertEqual(StravaSyncJob.objects.filter(status=StravaSyncJob.FAILED).count(), 0)
+
+    @override_settings(STRAVA_SYNC_RETRY_DELAY=60, STRAVA_SYNC_MAX_ATTEMPTS=3)
+    def test_failed_fetch_backs_off(self):
+        FakeStrava.activities.pop("token3")
+        with self.assertLogs('api.sync', 'ERROR'):
+            call_command('strava_sync', stdout=io.StringIO())
+        job = StravaSyncJob.objects.get(athlete=self.athletes[3])
+        self.assertEqual((job.status, job.attempts), (StravaSyncJob.PENDING, 1))
+        self.assertAlmostEqual(job.not_before, timezone.now() + datetime.timedelta(seconds=60),
+                               delta=datetime.timedelta(seconds=5))
+        self.assertIsNone(Athlete.objects.get(id=self.athletes[3].id).last_update)
+
+        # Neither retried before its delay nor queued again meanwhile
+        Athlete.objects.update(last_update=None)
+        self.assertEqual(sync.enqueue_stale_athletes(), 3)
+        self.assertNotIn(job, sync.claim_jobs(10))
+
+        for attempts, delay in [(2, 120), (3, None)]:
+            StravaSyncJob.objects.filter(pk=job.pk).update(not_before=timezone.now())
+            with self.assertLogs('api.sync', 'ERROR'):
+                sync.run_jobs(10, 1)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempts)
+            if delay:
+                self.assertEqual(job.status, StravaSyncJob.PENDING)
+                self.assertAlmostEqual(job.not_before, timezone.now() + datetime.timedelta(seconds=delay),
+                                       delta=datetime.timedelta(seconds=5))
+        self.assertEqual(job.status, StravaSyncJob.FAILED)
+
+    def test_failed_fetch_keeps_refreshed_tokens(self):
+        expired = self.athletes[0]
+        expired.access_token_expiration_date = timezone.now()
+        expired.save()
+        with self.assertLogs('api.sync', 'ERROR'):
+            call_command('strava_sync', stdout=io.StringIO())
+        job = StravaSyncJob.objects.get(athlete=expired)
+        self.assertEqual(job.status, StravaSyncJob.PENDING)
+        self.assertIn("401", job.error)
+        expired.refresh_from_db()
+        self.assertEqual(expired.access_token, "fresh-refresh0")
+        self.assertGreater(expired.access_token_expiration_date, timezone.now())
+
+    def test_activities_pages_and_race_window(self):
+        race = Race.objects.create(name="24h", start_date=datetime.datetime(2021, 4, 22, tzinfo=datetime.timezone.utc))
+        RaceDiscipline.objects.create(race=race, discipline=Discipline.objects.create(name="Run"),
+                                      duration=datetime.timedelta(hours=6))
+        Athlete.objects.filter(id=self.athletes[0].id).update(race=race)
+        FakeStrava.activities["token0"] = [strava_activity(n) for n in range(5)]
+        Athlete.objects.exclude(id=self.athletes[0].id).update(access_token=None)
+        with mock.patch('api.strava.PER_PAGE', 2):
+            call_command('strava_sync', stdout=io.StringIO())
+        self.assertEqual(StravaActivity.objects.count(), 5)
+        pages = [request[2] for request in FakeStrava.requests if request[0] == 'GET']
+        self.assertEqual([page['page'] for page in pages], [['1'], ['2'], ['3']])
+        self.assertEqual(pages[0]['after'], [str(int(race.start_date.timestamp()))])
+        self.assertEqual(pages[0]['before'], [str(int(race.start_date.timestamp()) + 6 * 3600)])
+
+    def test_ingestion_query_count(self):
+        athlete = self.athletes[0]
+        activities = [strava_activity(n) for n in range(30)]
+        # lookup of the known ids and the insert, within a savepoint
+        with self.assertNumQueries(4):
+            created, updated = sync.ingest_activities(athlete, activities)
+        self.assertEqual((len(created), len(updated)), (30, 0))
+        activities[0]["distance"] = 42195.0
+        with self.assertNumQueries(4):
+            created, updated = sync.ingest_activities(athlete, activities)
+        self.assertEqual((len(created), [activity.id for activity in updated]), (0, [0]))
+        self.assertEqual(StravaActivity.objects.get(id=0).distance, 42195.0)
+
+    def test_ingests_64_bit_ids(self):
+        # Strava activity ids passed 2^31 long ago.
+        FakeStrava.activities["token0"] = [strava_activity(12_000_000_000)]
+        sync.enqueue(self.athletes[0])
+        sync.run_jobs(10, 1)
+        self.assertEqual(StravaActivity.objects.get().id, 12_000_000_000)
+        Discipline.objects.create(name="Course", strava_type="Run", points_per_km=1)
+        pipeline.promote_strava_activities()
+        self.assertEqual(Activity.objects.get().activity_id, 12_000_000_000)
+
+    def test_promotion_scores_changed_activities(self):
+        Discipline.objects.create(name="Course", strava_type="Run", points_per_km=1)
+        Discipline.objects.create(name="Ride", points_per_km=0.5)
+        athlete = self.athletes[0]
+        team = Team.objects.create(name="Team", join_code="code", race=Race.objects.create(name="24h"),
+                                   category=Category.objects.create(name="Solo", label="Solo", max_participants=1))
+        Athlete.objects.filter(id=athlete.id).update(team=team)
+        activities = [strava_activity(1), strava_activity(2, type="Ride"), strava_activity(3, type="Yoga")]
+        sync.ingest_activities(athlete, activities)
+        self.assertEqual(pipeline.promote_strava_activities(), 2)
+        self.assertEqual(dict(Activity.objects.values_list('activity_id', 'points')), {1: 10, 2: 5})
+        self.assertEqual(Activity.objects.get(activity_id=1).avg_speed, 10000 / 3600)
+        upload_date = Activity.objects.get(activity_id=1).upload_date
+        self.assertEqual(pipeline.promote_strava_activities(), 0)
+        self.assertEqual(Activity.objects.get(activity_id=1).upload_date, upload_date)
+
+        activities[0]["distance"] = 20000.0
+        activities[1]["type"] = "Yoga"
+        sync.ingest_activities(athlete, activities)
+        self.assertEqual(pipeline.promote_strava_activities(), 2)
+        self.assertEqual(dict(Activity.objects.values_list('activity_id', 'points')), {1: 20})
+        self.assertEqual(Athlete.objects.get(id=athlete.id).points, 20)
+        self.assertEqual(Team.objects.get(id=team.id).points, 20)
+
+    @override_settings(STRAVA_PROMOTION_OVERLAP=300)
+    def test_promotion_catches_late_commits(self):
+        Discipline.objects.create(name="Run", points_per_km=1)
+        athlete = self.athletes[0]
+        sync.ingest_activities(athlete, [strava_activity(1)])
+        self.assertEqual(pipeline.promote_strava_activities(), 1)
+        # Dated before the watermark, as when its transaction committed after the previous promotion read
+        late = timezone.now() - datetime.timedelta(seconds=60)
+        sync.ingest_activities(athlete, [strava_activity(2)])
+        StravaActivity.objects.filter(id=2).update(updated_at=late)
+        self.assertEqual(pipeline.promote_strava_activities(), 1)
+        self.assertEqual(Athlete.objects.get(id=athlete.id).points, 20)
+
+    def test_webhook_events(self):
+        Discipline.objects.create(name="Run", points_per_km=1)
+        athlete = self.athletes[0]
+        Athlete.objects.filter(id=athlete.id).update(strava_id=1234, last_update=timezone.now())
+        Athlete.objects.exclude(id=athlete.id).update(last_update=timezone.now())
+        for activity in FakeStrava.activities["token0"]:
+            activity['athlete'] = {'id': 1234}
+        FakeStrava.activities["token0"].append(strava_activity(99, start_date='2019-01-01T10:00:00Z',
+                                                               athlete={'id': 1234}))
+        # A public activity of another athlete, readable with any token
+        FakeStrava.activities["token0"].append(strava_activity(98, athlete={'id': 4321}))
+        for activity_id in (1, 99, 98):
+            sync.enqueue_event({'object_type': 'activity', 'aspect_type': 'create', 'object_id': activity_id,
+                                'owner_id': 1234, 'subscription_id': 1, 'updates': {}})
+        self.assertIsNone(sync.enqueue_event({'object_type': 'activity', 'aspect_type': 'create', 'object_id': 5,
+                                              'owner_id': 4321, 'subscription_id': 1, 'updates': {}}))
+        with self.assertLogs('api.sync', 'WARNING'):
+            call_command('strava_sync', stdout=io.StringIO())
+        self.assertEqual(list(StravaActivity.objects.values_list('id', flat=True)), [1])
+        self.assertEqual(Athlete.objects.get(id=athlete.id).points, 10)
+        self.assertEqual(sorted(request[1] for request in FakeStrava.requests),
+                         ['/api/v3/activities/1', '/api/v3/activities/98', '/api/v3/activities/99'])
+
+        delete = {'object_type': 'activity', 'aspect_type': 'delete', 'object_id': 1, 'owner_id': 1234,
+                  'subscription_id': 1, 'updates': {}}
+        deauthorize = {'object_type': 'athlete', 'aspect_type': 'update', 'object_id': 1234, 'owner_id': 1234,
+                       'subscription_id': 1, 'updates': {'authorized': 'false'}}
+        # Not confirmed by Strava: the activity still exists and the refresh token is still valid
+        sync.enqueue_event(delete)
+        sync.enqueue_event(deauthorize)
+        call_command('strava_sync', stdout=io.StringIO())
+        self.assertTrue(Activity.objects.filter(activity_id=1).exists())
+        self.assertEqual(Athlete.objects.get(id=athlete.id).access_token, "fresh-refresh0")
+
+        FakeStrava.activities["fresh-refresh0"] = []
+        FakeStrava.revoked.add("refresh0")
+        sync.enqueue_event(delete)
+        sync.enqueue_event(deauthorize)
+        call_command('strava_sync', stdout=io.StringIO())
+        athlete = Athlete.objects.get(id=athlete.id)
+        self.assertFalse(StravaActivity.objects.exists())
+        self.assertFalse(Activity.objects.exists())
+        self.assertEqual(athlete.points, 0)
+        self.assertIsNone(athlete.access_token)
+
+    def test_refresh_expiring_tokens(self):
+        soon = timezone.now() + datetime.timedelta(minutes=10)
+        Athlete.objects.filter(id__in=[self.athletes[0].id, self.athletes[1].id]).update(
+            access_token_expiration_date=soon)
+        call_command('refresh_strava_tokens', within=20, batch_size=1, stdout=io.StringIO())
+        tokens = dict(Athlete.objects.values_list('id', 'access_token'))
+        self.assertEqual([tokens[athlete.id] for athlete in self.athletes],
+                         ["fresh-refresh0", "fresh-refresh1", "token2", "token3"])
+        self.assertGreater(Athlete.objects.get(id=self.athletes[0].id).access_token_expiration_date,
+                           timezone.now() + datetime.timedelta(hours=5))
+
+    def test_refresh_revoked_tokens(self):
+        Athlete.objects.filter(id=self.athletes[0].id).update(access_token_expiration_date=timezone.now())
+        FakeStrava.revoked.add("refresh0")
+        with self.assertLogs('api.sync', 'WARNING'):
+            self.assertEqual(sync.refresh_expiring_tokens(StravaClient(), 60, 10, 1), (0, 1))
+        athlete = Athlete.objects.get(id=self.athletes[0].id)
+        self.assertEqual((athlete.access_token, athlete.access_token_expiration_date, athlete.refresh_token),
+                         (None, None, None))
+        # Not refreshed again
+        self.assertEqual(sync.refresh_expiring_tokens(StravaClient(), 60, 10, 1), (0, 0))
+
+
+class RateLimitTestCase(TestCase):
+
+    def setUp(self):
+        self.now = 1000 * RateLimit.WINDOW + 60
+        self.slept = []
+        self.rate_limit = RateLimit(sleep=self.sleep, clock=lambda: self.now)
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+    def test_waits_for_next_window(self):
+        self.rate_limit.update({'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '598,1000'})
+        self.rate_limit.acquire()
+        self.rate_limit.acquire()
+        self.assertEqual(self.slept, [])
+        self.rate_limit.acquire()
+        self.assertEqual(self.slept, [RateLimit.WINDOW - 60])
+        self.assertEqual(self.rate_limit.usage, [1, 1003])
+
+    def test_non_blocking(self):
+        self.rate_limit.update({'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '600,1000'})
+        with self.assertRaises(RateLimitExceeded) as context:
+            self.rate_limit.acquire(block=False)
+        self.assertEqual(context.exception.retry_after, RateLimit.WINDOW - 60)
+        self.assertEqual(self.slept, [])
+
+    def test_daily_limit(self):
+        self.rate_limit.update({'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '10,30000'})
+        with self.assertRaises(RateLimitExceeded):
+            self.rate_limit.acquire()
+
+    def test_client_reads_headers(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStrava)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        FakeStrava.activities, FakeStrava.rate_limit_usage = {"token": []}, "600,1000"
+        client = StravaClient(rate_limit=self.rate_limit)
+        try:
+            with override_settings(STRAVA_API_URL=f'http://127.0.0.1:{server.server_port}/api/v3'):
+                client.list_activities("token", 0, 1)
+                client.list_activities("token", 0, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(self.slept, [RateLimit.WINDOW - 60])
@@ -0,0 +1,730 @@
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from My24h import schema
+from api.authentication import StatelessJWTAuthentication
+from api.cache import bump_version
+from api.models import Activity, Athlete, Category, Discipline, Race, RaceDiscipline, StravaSyncJob, Team
+from api.pagination import RankingPagination
+from api.views import RankingViewSet
+
+
+class RankingViewSetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.race = Race.objects.create(name="24h")
+        cls.category = Category.objects.create(name="Solo", label="Solo", max_participants=1)
+        points = [50, 40, 40, 40, 30, 20, 20, 10, 0, 0, 0, 0]
+        for index, value in enumerate(points):
+            team = Team.objects.create(name=f"Team {index}", join_code="code", race=cls.race, category=cls.category)
+            user = User.objects.create_user(username=f"athlete{index}", password="password")
+            Athlete.objects.create(user=user, gender="male" if index % 2 else "female",
+                                   birthday=datetime.date(2000, 1, 1), race=cls.race, category=cls.category,
+                                   team=team, points=value)
+        cls.expected_ranks = [1, 2, 2, 2, 5, 6, 6, 8, 9, 9, 9, 9]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    @mock.patch.object(RankingPagination, 'page_size', 3)
+    def walk(self, url):
+        rows = []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            rows += response.data['results']
+            url = response.data['next']
+        return rows
+
+    def test_athletes_ranking(self):
+        rows = self.walk('/My24h/api/rankings/athletes/')
+        self.assertEqual([row['rank'] for row in rows], self.expected_ranks)
+        self.assertEqual(len({row['id'] for row in rows}), len(self.expected_ranks))
+
+    def test_teams_ranking(self):
+        # Ranked on the running team totals, not on the members points.
+        for athlete in Athlete.objects.all():
+            Team.objects.filter(id=athlete.team_id).update(points=athlete.points + 1)
+        rows = self.walk(f'/My24h/api/rankings/teams/?race={self.race.id}')
+        self.assertEqual([row['points'] for row in rows], [51, 41, 41, 41, 31, 21, 21, 11, 1, 1, 1, 1])
+        self.assertEqual([row['rank'] for row in rows], self.expected_ranks)
+
+    def test_teams_ranking_by_gender(self):
+        rows = self.walk(f'/My24h/api/rankings/teams/?race={self.race.id}&gender=female')
+        self.assertEqual([row['points'] for row in rows], [50, 40, 30, 20] + [0] * 8)
+        self.assertEqual([row['rank'] for row in rows], [1, 2, 3, 4] + [5] * 8)
+
+    def test_snapshot(self):
+        url = '/My24h/api/rankings/athletes/'
+        first = self.client.get(url).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), first)
+
+        athlete = Athlete.objects.get(user__username="athlete11")
+        discipline = Discipline.objects.create(name="Run", points_per_km=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            Activity.objects.create(activity_id=1, athlete=athlete, discipline=discipline, distance=1000,
+                                    date=datetime.datetime(2022, 4, 23, tzinfo=datetime.timezone.utc),
+                                    positive_elevation_gain=0, negative_elevation_gain=0,
+                                    run_time=datetime.timedelta(hours=1), avg_speed=1)
+
+        # Another request is already recomputing the snapshot: the previous one is served meanwhile.
+        lock = f"{RankingViewSet.snapshot_key('athletes', {})}:lock"
+        cache.add(lock, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), first)
+        cache.delete(lock)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url).json()['results'][0]['username'], "athlete11")
+
+    @mock.patch.object(RankingPagination, 'page_size', 3)
+    @override_settings(ALLOWED_HOSTS=['testserver', 'example.com'])
+    def test_snapshot_key_ignores_query_order_and_host(self):
+        url = f'/My24h/api/rankings/teams/?race={self.race.id}&gender=female'
+        first = self.client.get(url, HTTP_HOST='example.com').json()
+        self.assertTrue(first['next'].startswith('/My24h/api/rankings/teams/?'))
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/My24h/api/rankings/teams/?gender=female&race={self.race.id}&utm=1')
+        self.assertEqual(response.json(), first)
+        self.assertEqual(self.client.get('/My24h/api/rankings/teams/?race=x').status_code, 400)
+        self.assertEqual(self.client.get('/My24h/api/rankings/teams/?cursor=x').status_code, 404)
+
+    async def test_snapshot_served_in_event_loop(self):
+        url = '/My24h/api/rankings/athletes/?gender=male'
+        client = AsyncClient()
+        first = (await client.get(url)).json()
+        with mock.patch('api.views.RankingViewSet.rank_athletes', return_value={'next': None, 'results': []}) \
+                as rank_athletes:
+            response = await client.get(url)
+            self.assertEqual(response.json(), first)
+            rank_athletes.assert_not_called()
+            await sync_to_async(bump_version)('rankings')
+            await client.get(url)
+            rank_athletes.assert_called_once()
+
+
+class TeamViewSetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.race = Race.objects.create(name="24h")
+        cls.category = Category.objects.create(name="Trio", label="Trio", max_participants=3)
+        cls.user = User.objects.create_user(username="viewer", password="password")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_teams(self, count):
+        for index in range(count):
+            team = Team.objects.create(name=f"Team {Team.objects.count()}", join_code="code", race=self.race,
+                                       category=self.category)
+            for rank in range(3):
+                user = User.objects.create_user(username=f"{team.name} {rank}", password="password")
+                Athlete.objects.create(user=user, gender="unknown", birthday=datetime.date(2000, 1, 1),
+                                       race=self.race, team=team, admin=team if rank == 0 else None)
+
+    def test_list_query_count(self):
+        for count in (1, 10):
+            self.create_teams(count)
+            # count, teams, members and admins
+            with self.assertNumQueries(4):
+                response = self.client.get('/My24h/api/teams/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results'][0]['members']), 3)
+
+    def test_retrieve_query_count(self):
+        self.create_teams(1)
+        team = Team.objects.get()
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/My24h/api/teams/{team.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['admins']), 1)
+
+
+def create_athletes(race, count, prefix="athlete"):
+    athletes = []
+    for index in range(count):
+        user = User.objects.create_user(username=f"{prefix}{index}", password="password")
+        athletes.append(Athlete.objects.create(user=user, gender="unknown", birthday=datetime.date(2000, 1, 1),
+                                               race=race))
+    return athletes
+
+
+class TeamMembershipTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.race = Race.objects.create(name="24h")
+        category = Category.objects.create(name="Duo", label="Duo", max_participants=2)
+        cls.team = Team.objects.create(name="Team", join_code="code", race=cls.race, category=category)
+        cls.athletes = create_athletes(cls.race, 3)
+
+    def join(self, athlete, team=None, join_code="code"):
+        client = APIClient()
+        client.force_authenticate(athlete.user)
+        return client.post(f'/My24h/api/teams/{(team or self.team).id}/join/', {"join_code": join_code})
+
+    def leave(self, athlete):
+        client = APIClient()
+        client.force_authenticate(athlete.user)
+        return client.post(f'/My24h/api/teams/{self.team.id}/leave/')
+
+    def test_join_capacity(self):
+        self.assertEqual(self.join(self.athletes[0], join_code="wrong").status_code, 403)
+        self.assertEqual(self.join(self.athletes[0]).status_code, 200)
+        self.assertEqual(self.join(self.athletes[0]).status_code, 400)
+        self.assertEqual(self.join(self.athletes[1]).status_code, 200)
+        self.assertEqual(self.join(self.athletes[2]).status_code, 400)
+        self.assertEqual(self.team.members.count(), 2)
+
+    def test_join_moves_points(self):
+        Athlete.objects.filter(id=self.athletes[0].id).update(points=10)
+        other = Team.objects.create(name="Other", join_code="other", race=self.race, category=self.team.category)
+        self.join(self.athletes[0])
+        self.join(self.athletes[0], other, "other")
+        self.assertEqual(Team.objects.get(id=self.team.id).points, 0)
+        self.assertEqual(Team.objects.get(id=other.id).points, 10)
+
+    def test_join_query_count(self):
+        for athlete in self.athletes[:2]:
+            client = APIClient()
+            client.force_authenticate(athlete.user)
+            # athlete id, athlete and team locks, count and category, save moving the points (in savepoints),
+            # then the team with members and admins
+            with self.assertNumQueries(15):
+                response = client.post(f'/My24h/api/teams/{self.team.id}/join/', {"join_code": "code"})
+            self.assertEqual(response.status_code, 200)
+
+    def test_leave_hands_admin_over(self):
+        for athlete in self.athletes[:2]:
+            self.join(athlete)
+        Athlete.objects.filter(id=self.athletes[1].id).update(admin=self.team)
+        self.assertEqual(self.leave(self.athletes[1]).status_code, 200)
+        self.assertEqual(list(self.team.admins.all()), [self.athletes[0]])
+        self.assertEqual(self.leave(self.athletes[0]).status_code, 200)
+        self.assertFalse(Team.objects.exists())
+        self.assertEqual(self.leave(self.athletes[2]).status_code, 404)
+
+    def test_invalid_team_id(self):
+        client = APIClient()
+        client.force_authenticate(self.athletes[0].user)
+        for action in ('join', 'leave'):
+            self.assertEqual(client.post(f'/My24h/api/teams/abc/{action}/').status_code, 404)
+
+    def test_lock_order(self):
+        # SQLite has no row locks: check that the athlete is locked first, then both teams by increasing id.
+        other = Team.objects.create(name="Other", join_code="other", race=self.race, category=self.team.category)
+        self.join(self.athletes[0], other, "other")
+        locked = []
+        select_for_update = QuerySet.select_for_update
+
+        def record(queryset, *args, **kwargs):
+            locked.append(queryset.model)
+            return select_for_update(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=record), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.join(self.athletes[0]).status_code, 200)
+        # Saving the athlete locks its row again to move the points, which it already holds.
+        self.assertEqual(locked, [Athlete, Team, Athlete])
+        team_lock = next(query['sql'] for query in queries if query['sql'].startswith('SELECT "api_team"'))
+        self.assertIn(' IN (', team_lock)
+        self.assertTrue(team_lock.endswith('ORDER BY "api_team"."id" ASC'))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class TeamMembershipConcurrencyTestCase(TransactionTestCase):
+
+    def setUp(self):
+        race = Race.objects.create(name="24h")
+        category = Category.objects.create(name="Trio", label="Trio", max_participants=3)
+        self.teams = [Team.objects.create(name=f"Team {index}", join_code="code", race=race, category=category)
+                      for index in range(2)]
+        self.athletes = create_athletes(race, 20)
+        Athlete.objects.update(points=1)
+
+    def post(self, athlete, team, action):
+        try:
+            client = APIClient()
+            client.force_authenticate(athlete.user)
+            return client.post(f'/My24h/api/teams/{team.id}/{action}/', {"join_code": "code"}).status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_joins(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            statuses = list(executor.map(lambda athlete: self.post(athlete, self.teams[0], 'join'), self.athletes))
+        self.assertEqual(statuses.count(200), 3)
+        self.assertEqual(self.teams[0].members.count(), 3)
+
+    def test_concurrent_joins_and_leaves(self):
+        requests = [(athlete, self.teams[index % 2], action) for index, athlete in enumerate(self.athletes)
+                    for action in ('join', 'leave', 'join')]
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            list(executor.map(lambda args: self.post(*args), requests))
+        for team in Team.objects.all():
+            self.assertLessEqual(team.members.count(), 3)
+            self.assertEqual(team.points, team.members.count())
+
+
+class AthleteViewSetTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.race = Race.objects.create(name="24h")
+        for name in ("Run", "Bike", "Swim"):
+            RaceDiscipline.objects.create(race=cls.race, discipline=Discipline.objects.create(name=name))
+        category = Category.objects.create(name="Solo", label="Solo", max_participants=1)
+        cls.team = Team.objects.create(name="Team", join_code="code", race=cls.race, category=category)
+        for index in range(5):
+            user = User.objects.create_user(username=f"athlete{index}", password="password")
+            Athlete.objects.create(user=user, gender="unknown", birthday=datetime.date(2000, 1, 1),
+                                   race=cls.race, team=cls.team)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.athlete = Athlete.objects.first()
+        self.client.force_authenticate(self.athlete.user)
+
+    def test_retrieve_query_count(self):
+        # athlete with user, team and race, then race disciplines
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/My24h/api/athletes/{self.athlete.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['race']['disciplines']), 3)
+
+    def test_list_query_count(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/My24h/api/athletes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+
+    def test_strava_rate_limited(self):
+        from api import strava
+
+        rate_limit = strava.RateLimit(clock=lambda: 1000 * strava.RateLimit.WINDOW + 60)
+        rate_limit.update({'X-RateLimit-Limit': '600,30000', 'X-RateLimit-Usage': '600,1000'})
+        with mock.patch('api.strava._clients', {}), mock.patch('api.strava._rate_limit', rate_limit):
+            response = self.client.post(f'/My24h/api/athletes/{self.athlete.id}/strava/',
+                                        {'authorization_code': 'code'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(strava.RateLimit.WINDOW - 60))
+        self.assertFalse(StravaSyncJob.objects.exists())
+
+    @mock.patch('api.pagination.OrderingCursorPagination.page_size', 2)
+    def test_cursor_pagination(self):
+        for index in range(5, 8):
+            user = User.objects.create_user(username=f"athlete{index}", password="password")
+            Athlete.objects.create(user=user, gender="unknown", birthday=datetime.date(2000, 1, 1), race=self.race)
+        usernames = []
+        url = '/My24h/api/athletes/?cursor='
+        while url:
+            # athletes, then race disciplines: no count, whatever the depth
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            usernames += [athlete['user']['username'] for athlete in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(usernames, [f"athlete{index}" for index in range(8)])
+
+
+class ActivityFeedTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        race = Race.objects.create(name="24h")
+        cls.athlete = create_athletes(race, 1)[0]
+        cls.discipline = Discipline.objects.create(name="Run", points_per_km=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.athlete.user)
+        self.url = f'/My24h/api/athletes/{self.athlete.id}/activities/'
+
+    def create_activity(self, activity_id, updated_at, discipline=None):
+        return Activity.objects.create(activity_id=activity_id, athlete=self.athlete,
+                                       discipline=discipline or self.discipline,
+                                       date=datetime.datetime(2022, 4, 23, tzinfo=datetime.timezone.utc),
+                                       updated_at=updated_at, distance=1000, positive_elevation_gain=0,
+                                       negative_elevation_gain=0, run_time=datetime.timedelta(hours=1), avg_speed=10)
+
+    @mock.patch('api.pagination.ActivityFeedPagination.page_size', 2)
+    def test_incremental_feed(self):
+        updated_at = datetime.datetime(2022, 4, 23, 12, tzinfo=datetime.timezone.utc)
+        for activity_id in (3, 1, 2):
+            self.create_activity(activity_id, updated_at)
+        response = self.client.get(self.url)
+        self.assertEqual([activity['id'] for activity in response.data['results']], [1, 2])
+        self.assertTrue(response.data['more'])
+        # activities, then deletions
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"since": response.data['since']})
+        self.assertEqual([activity['id'] for activity in response.data['results']], [3])
+        self.assertFalse(response.data['more'])
+        since = response.data['since']
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, {"since": since})
+        self.assertEqual(response.status_code, 304)
+        # an edited activity is sent again
+        activity = Activity.objects.get(activity_id=1)
+        activity.distance = 2000
+        activity.save()
+        response = self.client.get(self.url, {"since": since})
+        self.assertEqual([activity['id'] for activity in response.data['results']], [1])
+
+    def test_rescored_activities_are_sent(self):
+        ride = Discipline.objects.create(name="Ride", points_per_km=5)
+        updated_at = timezone.now() - datetime.timedelta(hours=1)
+        self.create_activity(1, updated_at)
+        self.create_activity(2, updated_at, discipline=ride)
+        since = self.client.get(self.url).data['since']
+
+        Discipline.objects.filter(id=self.discipline.id).update(points_per_km=20)
+        call_command('rescore_activities', stdout=io.StringIO())
+        response = self.client.get(self.url, {"since": since})
+        self.assertEqual([(activity['id'], activity['points']) for activity in response.data['results']], [(1, 20)])
+
+    def test_deletions_are_sent(self):
+        updated_at = timezone.now() - datetime.timedelta(hours=1)
+        for activity_id in (1, 2):
+            self.create_activity(activity_id, updated_at)
+        response = self.client.get(self.url)
+        self.assertEqual([activity['deleted'] for activity in response.data['results']], [False, False])
+        since = response.data['since']
+
+        Activity.objects.get(activity_id=1).delete()
+        self.create_activity(3, timezone.now())
+        Activity.objects.filter(activity_id=2).delete()
+        response = self.client.get(self.url, {"since": since})
+        self.assertEqual([(activity['id'], activity['deleted']) for activity in response.data['results']],
+                         [(1, True), (3, False), (2, True)])
+        self.assertEqual(response.data['results'][0], {'id': 1, 'deleted': True})
+        self.assertEqual(self.client.get(self.url, {"since": response.data['since']}).status_code, 304)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+        self.assertEqual(self.client.get(self.url, {"since": "invalid"}).status_code, 404)
+        self.assertEqual(self.client.get('/My24h/api/athletes/0/activities/').status_code, 404)
+        self.assertEqual(self.client.get('/My24h/api/athletes/abc/activities/').status_code, 404)
+        self.assertEqual(self.client.get('/My24h/api/athletes/abc/strava_activities/').status_code, 404)
+
+
+def picture(name="picture.png", size=(400, 300), image_format='PNG'):
+    content = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(content, image_format)
+    return SimpleUploadedFile(name, content.getvalue())
+
+
+class PicturesTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        race = Race.objects.create(name="24h")
+        category = Category.objects.create(name="Duo", label="Duo", max_participants=2)
+        cls.team = Team.objects.create(name="Team", join_code="code", race=race, category=category)
+        cls.athlete, cls.other = create_athletes(race, 2)
+        Athlete.objects.filter(id=cls.athlete.id).update(team=cls.team, admin=cls.team)
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.athlete.user)
+        self.url = f'/My24h/api/athletes/{self.athlete.id}/profile_pictures/'
+
+    def test_upload_and_thumbnails(self):
+        response = self.client.post(self.url, {"profile_picture": picture()}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['thumbnail'])
+        call_command('generate_thumbnails', stdout=io.StringIO())
+        response = self.client.get(self.url)
+        self.assertRegex(response.data['thumbnail'], r'/media/athletes/thumbnails/\d+-[0-9a-f]{12}\.webp$')
+        self.assertRegex(response.data['thumbnail_jpeg'], r'\.jpg$')
+        athlete = Athlete.objects.get(id=self.athlete.id)
+        with Image.open(athlete.thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.size, (128, 128))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {"profile_picture": picture(image_format='JPEG')}, format='multipart')
+        self.assertFalse(os.path.exists(athlete.thumbnail.path))
+        self.assertFalse(os.path.exists(athlete.image.path))
+        self.assertEqual(Athlete.objects.get(id=self.athlete.id).thumbnail, '')
+
+    def test_team_picture(self):
+        response = self.client.post(f'/My24h/api/teams/{self.team.id}/pictures/', {"picture": picture()},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 200)
+        call_command('generate_thumbnails', stdout=io.StringIO())
+        response = self.client.get(f'/My24h/api/teams/{self.team.id}/')
+        self.assertRegex(response.data['thumbnail'], r'/media/teams/thumbnails/')
+        self.client.force_authenticate(self.other.user)
+        response = self.client.post(f'/My24h/api/teams/{self.team.id}/pictures/', {"picture": picture()},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+    def test_validation(self):
+        self.client.force_authenticate(self.other.user)
+        self.assertEqual(self.client.post(self.url, {"profile_picture": picture()}, format='multipart').status_code,
+                         403)
+        self.client.force_authenticate(self.athlete.user)
+        text = SimpleUploadedFile("picture.png", b"not a picture")
+        self.assertEqual(self.client.post(self.url, {"profile_picture": text}, format='multipart').status_code, 400)
+        gif = picture("picture.gif", image_format='GIF')
+        self.assertEqual(self.client.post(self.url, {"profile_picture": gif}, format='multipart').status_code, 400)
+        with override_settings(PICTURE_MAX_PIXELS=1000):
+            response = self.client.post(self.url, {"profile_picture": picture()}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class TokenAuthenticationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        race = Race.objects.create(name="24h")
+        category = Category.objects.create(name="Duo", label="Duo", max_participants=2)
+        cls.team = Team.objects.create(name="Team", join_code="code", race=race, category=category)
+        cls.user = User.objects.create_user(username="runner", password="password")
+        cls.athlete = Athlete.objects.create(user=cls.user, gender="unknown", birthday=datetime.date(2000, 1, 1),
+                                             race=race, team=cls.team, admin=cls.team)
+        user = User.objects.create_user(username="member", password="password")
+        cls.member = Athlete.objects.create(user=user, gender="unknown", birthday=datetime.date(2000, 1, 1),
+                                            race=race, team=cls.team)
+
+    def setUp(self):
+        StatelessJWTAuthentication.active_users.entries.clear()
+        self.client = APIClient()
+
+    def authenticate(self, username):
+        response = self.client.post('/My24h/api/token/', {"username": username, "password": "password"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return AccessToken(response.data['access'])
+
+    def test_claims(self):
+        token = self.authenticate("runner")
+        self.assertEqual(token['name'], "runner")
+        self.assertEqual(token['athlete_id'], self.athlete.id)
+        self.assertEqual(token['team_id'], self.team.id)
+        self.assertEqual(token['admin_team_id'], self.team.id)
+
+    def test_user_not_loaded(self):
+        self.authenticate("runner")
+        # active user check, then athlete with user, team and race, then race disciplines
+        with self.assertNumQueries(3):
+            self.client.get(f'/My24h/api/athletes/{self.athlete.id}/')
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/My24h/api/athletes/{self.athlete.id}/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_inactive_user_rejected(self):
+        self.authenticate("runner")
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        response = self.client.get(f'/My24h/api/athletes/{self.athlete.id}/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_rights_checked_against_database(self):
+        self.authenticate("member")
+        response = self.client.put(f'/My24h/api/teams/{self.team.id}/join_codes/', {"join_code": "new"})
+        self.assertEqual(response.status_code, 403)
+        Athlete.objects.filter(id=self.member.id).update(admin=self.team)
+        response = self.client.put(f'/My24h/api/teams/{self.team.id}/join_codes/', {"join_code": "new"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Team.objects.get().join_code, "new")
+
+
+@override_settings(STRAVA_WEBHOOK_VERIFY_TOKEN="verify", STRAVA_WEBHOOK_SUBSCRIPTION_ID="7")
+class StravaWebhookTestCase(TestCase):
+    url = '/My24h/api/strava/webhook/'
+
+    def test_subscription_challenge(self):
+        response = APIClient().get(self.url, {'hub.mode': 'subscribe', 'hub.verify_token': 'verify',
+                                              'hub.challenge': 'abc'})
+        self.assertEqual(response.json(), {'hub.challenge': 'abc'})
+        response = APIClient().get(self.url, {'hub.mode': 'subscribe', 'hub.verify_token': 'wrong',
+                                              'hub.challenge': 'abc'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_event_is_queued(self):
+        user = User.objects.create_user(username="runner", password="password")
+        athlete = Athlete.objects.create(user=user, gender="unknown", birthday=datetime.date(2000, 1, 1),
+                                         strava_id=42)
+        event = {'object_type': 'activity', 'aspect_type': 'create', 'object_id': 123456789012, 'owner_id': 42,
+                 'subscription_id': 7, 'event_time': 1650000000, 'updates': {}}
+        with self.assertNumQueries(2):
+            response = APIClient().post(self.url, event, format='json')
+        self.assertEqual(response.status_code, 200)
+        job = StravaSyncJob.objects.get()
+        self.assertEqual((job.athlete_id, job.kind, job.activity_id),
+                         (athlete.id, StravaSyncJob.FETCH_ACTIVITY, 123456789012))
+
+    def test_invalid_event_is_rejected(self):
+        event = {'object_type': 'activity', 'aspect_type': 'create', 'object_id': 1, 'owner_id': 42,
+                 'subscription_id': 7}
+        for invalid in [dict(event, subscription_id=8), dict(event, owner_id="x"), dict(event, object_id=None),
+                        dict(event, aspect_type="merge")]:
+            response = APIClient().post(self.url, invalid, format='json')
+            self.assertEqual(response.status_code, 400)
+        with override_settings(STRAVA_WEBHOOK_SUBSCRIPTION_ID=None):
+            response = APIClient().post(self.url, event, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(StravaSyncJob.objects.exists())
+
+
+class ReferenceCacheTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.race = Race.objects.create(name="24h")
+        RaceDiscipline.objects.create(race=cls.race, discipline=Discipline.objects.create(name="Run"))
+        Category.objects.create(name="Solo", label="Solo", max_participants=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_cached_until_modified(self):
+        with self.assertNumQueries(3):
+            first = self.client.get('/My24h/api/races/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/My24h/api/races/')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        Discipline.objects.update(name="Trail")
+        Discipline.objects.get().save()
+        response = self.client.get('/My24h/api/races/')
+        self.assertEqual(response.json()['results'][0]['disciplines'][0]['discipline']['name'], "Trail")
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_not_modified(self):
+        etag = self.client.get('/My24h/api/categories/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/My24h/api/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        race = self.client.get(f'/My24h/api/races/{self.race.id}/')
+        self.assertEqual(race.json()['name'], "24h")
+        self.assertNotEqual(race['ETag'], etag)
+
+
+class ExportResultsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        race = Race.objects.create(name="24h")
+        category = Category.objects.create(name="Duo", label="Duo", max_participants=2)
+        team = Team.objects.create(name="Team", join_code="code", race=race, category=category)
+        run = Discipline.objects.create(name="Run", points_per_km=10)
+        Discipline.objects.create(name="Swim", points_per_km=100)
+        cls.athletes = create_athletes(race, 3)
+        Athlete.objects.filter(id=cls.athletes[0].id).update(team=team, category=category)
+        for activity_id, distance in ((1, 1000), (2, 2000)):
+            Activity.objects.create(activity_id=activity_id, athlete=cls.athletes[0], discipline=run,
+                                    date=datetime.datetime(2022, 4, 23, tzinfo=datetime.timezone.utc),
+                                    distance=distance, positive_elevation_gain=0, negative_elevation_gain=0,
+                                    run_time=datetime.timedelta(hours=1), avg_speed=10)
+        cls.staff = User.objects.create_user(username="organizer", password="password", is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_reserved_to_staff(self):
+        self.client.force_authenticate(self.athletes[0].user)
+        self.assertEqual(self.client.get('/My24h/api/results/export/').status_code, 403)
+
+    def test_csv(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/My24h/api/results/export/')
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "athlete_id,username,first_name,last_name,gender,team,category,race,points,Run,Swim")
+        self.assertEqual(lines[1], f"{self.athletes[0].id},athlete0,,,unknown,Team,Duo,24h,30.0,30.0,0")
+        self.assertEqual(len(lines), 4)
+
+    async def test_csv_in_event_loop(self):
+        response = await AsyncClient().get('/My24h/api/results/export/',
+                                           authorization=f"Bearer {AccessToken.for_user(self.staff)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="results.csv"')
+        self.assertEqual(len(response.content.decode().splitlines()), 4)
+
+    def test_ndjson_command(self):
+        stdout = io.StringIO()
+        call_command('export_results', output='ndjson', chunk_size=2, stdout=stdout)
+        results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([result['username'] for result in results], ["athlete0", "athlete1", "athlete2"])
+        self.assertEqual(results[0]['disciplines'], {"Run": 30.0, "Swim": 0})
+
+
+class DocumentationTestCase(TestCase):
+
+    def setUp(self):
+        self.schema_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.schema_root)
+        settings = override_settings(SCHEMA_ROOT=self.schema_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch.dict(schema._schemas, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_schema(self):
+        response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, 200)
+        operations = {operation.get('operationId') for path in response.json()['paths'].values()
+                      for operation in path.values() if isinstance(operation, dict)}
+        self.assertIn('Create profile picture', operations)
+
+    def test_generated_schema_is_served(self):
+        call_command('generate_schema', format=['json'], stdout=io.StringIO())
+        with open(os.path.join(self.schema_root, 'swagger.json')) as file:
+            self.assertIn('Create profile picture', file.read())
+        with mock.patch('My24h.schema.generate_schema') as generate_schema:
+            for url in ['/swagger.json', '/My24h/?format=openapi']:
+                self.assertIn(b'Create profile picture', self.client.get(url).content)
+        generate_schema.assert_not_called()
+        self.assertContains(self.client.get('/My24h/'), '/static/swagger.json')
+
+    def test_generated_yaml_schema_is_served(self):
+        with open(os.path.join(self.schema_root, 'swagger.yaml'), 'w') as file:
+            file.write('swagger: "2.0"\n')
+        with mock.patch('My24h.schema.generate_schema') as generate_schema:
+            response = self.client.get('/swagger.yaml')
+        generate_schema.assert_not_called()
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/yaml'))
+
+    @override_settings(DEBUG=True)
+    def test_debug_schema_follows_urlconf(self):
+        with mock.patch('My24h.schema.generate_schema', wraps=schema.generate_schema) as generate_schema:
+            self.client.get('/swagger.json')
+            self.client.get('/swagger.json')
+            self.assertEqual(generate_schema.call_count, 1)
+            clear_url_caches()
+            self.client.get('/swagger.json')
+            self.assertEqual(generate_schema.call_count, 2)
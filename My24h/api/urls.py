@@ -9,6 +9,7 @@ router.register(r'categories', views.CategoryViewSet, basename="Categories")
 router.register(r'athletes', views.AthleteViewSet, basename="Racers")
 router.register(r'races', views.RaceViewSet, basename="Races")
 router.register(r'teams', views.TeamViewSet, basename="Teams")
+router.register(r'rankings', views.RankingViewSet, basename="Rankings")
 
 
 # Wire up our API using automatic URL routing.
@@ -18,6 +19,8 @@ urlpatterns = [
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('token/', views.access_token, name="token"),
     path('token/refresh/', views.refresh_tocken, name="refresh token"),
+    path('strava/webhook/', views.strava_webhook, name="strava webhook"),
+    path('results/export/', views.export_results, name="export results"),
     path('reset_password', auth_views.PasswordResetView.as_view()),
     path('rest_password/done', auth_views.PasswordResetDoneView.as_view()),
     path('password/<uidb64>/<token>', auth_views.PasswordResetConfirmView.as_view()),
@@ -1,29 +1,66 @@
 import datetime
-import requests
-import os
-import time
-
-from django.utils.timezone import now
-from django.db import IntegrityError
+import math
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import authenticate
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 
 from rest_framework import mixins, viewsets, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rest_framework.decorators import action, permission_classes, api_view
+from rest_framework.decorators import action, permission_classes, api_view, authentication_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from drf_yasg.utils import swagger_auto_schema
+from drf_yasg import openapi
+from drf_yasg.utils import no_body, swagger_auto_schema
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .serializer import ActivityDeletionSerializer, ActivityFeedSerializer, AthleteRankingSerializer, \
+    AthleteSerializer, CategorySerializer, CustomTokenObtainPairSerializer, PictureSerializer, RaceSerializer, \
+    StravaActivitySerializer, StravaEventSerializer, TeamLightSerializer, TeamRankingSerializer, TeamSerializer, \
+    set_athlete_claims
+from .models import Activity, ActivityDeletion, Athlete, Category, Race, RaceDiscipline, StravaActivity, Team
+from . import export, images
+from .cache import CachedReadMixin, snapshot, snapshot_key
+from .pagination import ActivityFeedPagination, RankingPagination
+from .doc_serializers.query_serializers import ActivityFeedQuerySerializer, ExportQuerySerializer, \
+    RankingQuerySerializer
+from .permissions import IsStaff
+
+
+def get_athlete_id(request):
+    athlete_id = getattr(request.user, 'athlete_id', None)
+    if athlete_id is None:
+        athlete_id = Athlete.objects.filter(user__id=request.user.id).values_list('id', flat=True).first()
+    return athlete_id
+
+
+def administered_by(athlete_id):
+    return Athlete.objects.filter(id=athlete_id, admin__isnull=False).values('admin_id')
 
-from .serializer import *
-from .models import *
 
+def lock_teams(*team_ids):
+    # Always lock in the same order, so that two athletes swapping teams cannot deadlock.
+    teams = Team.objects.select_for_update().filter(id__in=[team_id for team_id in team_ids if team_id is not None])
+    return {team.id: team for team in teams.order_by('id')}
 
-class CategoryViewSet(mixins.ListModelMixin,
+
+class CategoryViewSet(CachedReadMixin,
+                      mixins.ListModelMixin,
                       mixins.RetrieveModelMixin,
                       viewsets.GenericViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    authentication_classes = []
     permission_classes = [AllowAny]
+    cache_group = 'reference'
     tags = ['Categories']
 
     @swagger_auto_schema(operation_id='List categories',
@@ -41,12 +78,17 @@ class CategoryViewSet(mixins.ListModelMixin,
         return super(CategoryViewSet, self).retrieve(request=request, args=args, kwargs=kwargs)
 
 
-class RaceViewSet(mixins.ListModelMixin,
+class RaceViewSet(CachedReadMixin,
+                  mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   viewsets.GenericViewSet):
-    queryset = Race.objects.all()
+    queryset = Race.objects.prefetch_related(
+        Prefetch('disciplines', queryset=RaceDiscipline.objects.select_related('discipline'))
+    )
     serializer_class = RaceSerializer
+    authentication_classes = []
     permission_classes = [AllowAny]
+    cache_group = 'reference'
     tags = ['Races']
 
     @swagger_auto_schema(operation_id='List races',
@@ -61,8 +103,7 @@ class RaceViewSet(mixins.ListModelMixin,
                          tags=tags,
                          security=[])
     def retrieve(self, request, *args, **kwargs):
-        super(RaceViewSet, self).retrieve(
-            request=request, args=args, kwargs=kwargs)
+        return super(RaceViewSet, self).retrieve(request=request, args=args, kwargs=kwargs)
 
 
 class AthleteViewSet(mixins.ListModelMixin,
@@ -70,7 +111,9 @@ class AthleteViewSet(mixins.ListModelMixin,
                      mixins.CreateModelMixin,
                      mixins.UpdateModelMixin,
                      viewsets.GenericViewSet):
-    queryset = Athlete.objects.all()
+    queryset = Athlete.objects.select_related('user', 'team', 'race').prefetch_related(
+        Prefetch('race__disciplines', queryset=RaceDiscipline.objects.select_related('discipline'))
+    )
     serializer_class = AthleteSerializer
     permission_classes = [AllowAny]
     tags = ['Athletes']
@@ -92,7 +135,7 @@ class AthleteViewSet(mixins.ListModelMixin,
                          operation_description='List all the athletes registered.',
                          tags=tags)
     def list(self, request, *args, **kwargs):
-        return super(AthleteViewSet, self).retrieve(request, *args, **kwargs)
+        return super(AthleteViewSet, self).list(request, *args, **kwargs)
 
     @swagger_auto_schema(operation_id='Create athlete',
                          operation_description='Create a new athlete',
@@ -112,7 +155,7 @@ class AthleteViewSet(mixins.ListModelMixin,
         try:
             try:
                 race = Race.objects.get(id=race_id)
-            except models.ObjectDoesNotExist:
+            except ObjectDoesNotExist:
                 return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Race {race_id} does not exist."})
             birthday = datetime.datetime.strptime(
                 request.POST.get("birthdate"), "%Y-%m-%d")
@@ -138,7 +181,7 @@ class AthleteViewSet(mixins.ListModelMixin,
                         race=race
                     )
                     athlete.save()
-                    refresh = RefreshToken.for_user(user)
+                    refresh = CustomTokenObtainPairSerializer.get_token(user, athlete)
                     return Response({
                         "id": athlete.id,
                         "access": str(refresh.access_token),
@@ -162,7 +205,7 @@ class AthleteViewSet(mixins.ListModelMixin,
         zip_code = request.POST.get("zip_code")
         city = request.POST.get("city")
         try:
-            athlete = Athlete.objects.get(id=kwargs["pk"])
+            athlete = self.get_queryset().get(id=kwargs["pk"])
             if phone:
                 athlete.phone = phone
             if email:
@@ -176,7 +219,7 @@ class AthleteViewSet(mixins.ListModelMixin,
                 athlete.city = city
             athlete.save()
             return Response(AthleteSerializer(athlete).data)
-        except models.ObjectDoesNotExist:
+        except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': "Athlete not found"})
 
     @swagger_auto_schema(operation_id='Partially update athlete',
@@ -187,101 +230,101 @@ class AthleteViewSet(mixins.ListModelMixin,
 
     @swagger_auto_schema(method='GET',
                          operation_id='Get profile picture',
-                         operation_description='Retrieve the profile picture of an athlete',
+                         operation_description='Retrieve the profile picture of an athlete and its thumbnails.',
+                         responses={200: PictureSerializer},
                          tags=tags)
     @swagger_auto_schema(method='POST',
                          operation_id='Create profile picture',
-                         operation_description="Add a profile picture to a racer profile",
+                         operation_description="Upload the profile picture of the authenticated athlete. Its "
+                                               "thumbnails are generated in the background.",
+                         request_body=no_body,
+                         manual_parameters=[openapi.Parameter('profile_picture', openapi.IN_FORM,
+                                                              type=openapi.TYPE_FILE, required=True)],
+                         responses={200: PictureSerializer},
                          tags=tags)
-    @action(detail=True, methods=['GET', 'POST'])
+    @action(detail=True, methods=['GET', 'POST'], parser_classes=[MultiPartParser])
     def profile_pictures(self, request, pk=None):
         try:
-            racer = Athlete.objects.get(id=pk)
-        except models.ObjectDoesNotExist:
+            racer = Athlete.objects.only('id', 'image', 'thumbnail', 'thumbnail_jpeg').get(id=pk)
+        except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Racer with id {pk} not found."})
         if request.method == "POST":
-            racer.image = request.POST.get("profile_picture")
-            racer.save()
-        return Response(racer)
+            if racer.id != get_athlete_id(request):
+                return Response(status=status.HTTP_403_FORBIDDEN,
+                                data={'err': "Athletes can only change their own profile picture"})
+            upload = PictureSerializer(data={'picture': request.FILES.get("profile_picture")})
+            if not upload.is_valid():
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'err': upload.errors['picture']})
+            images.replace_picture(racer, upload.validated_data['picture'])
+        return Response(PictureSerializer(racer, context={'request': request}).data)
 
     @swagger_auto_schema(method='POST',
                          operation_id='Connect to Strava',
                          operation_description="Connect to the athlete's Strava account.",
                          tags=tags)
     @action(detail=True, methods=['POST'], permission_classes=[IsAuthenticated])
-    def strava(self, request):
+    def strava(self, request, pk=None):
         authorization_code = request.POST.get("authorization_code")
         if authorization_code:
-            data = {
-                "client_id": os.getenv("CLIENT_ID"),
-                "client_secret": os.getenv("CLIENT_SECRET"),
-                "code": authorization_code,
-                "grant": "authorization_code"
-            }
-            response = requests.post(
-                url="https://www.strava.com/oauth/token",
-                data=data
-            )
-            if response.status_code < 300:
-                user_id = request.user.id
-                athlete = Athlete.objects.get(user__id=user_id)
-                data = response.json()
-                athlete.access_token = data.get("access_token")
-                athlete.access_token_expiration_date = datetime.datetime.fromtimestamp(
-                    data.get("expires_at"))
-                athlete.refresh_token = data.get("refresh_token")
-                athlete.strava_id = data.get("athlete").get("id")
-                athlete.save()
-                return Response("Successfully updated/ En cours de réparation")
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            # The Strava client and its HTTP stack are only loaded by the workers which need them.
+            import requests
+            from . import strava, sync
+            try:
+                data = strava.get_client(block=False).exchange_token(authorization_code)
+            except strava.RateLimitExceeded as e:
+                return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, data={'err': str(e)},
+                                headers={'Retry-After': str(math.ceil(e.retry_after))})
+            except requests.RequestException:
+                return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            try:
+                athlete = Athlete.objects.get(id=get_athlete_id(request))
+            except ObjectDoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND, data={'err': "Athlete not found"})
+            strava.set_tokens(athlete, data)
+            athlete.save()
+            sync.enqueue(athlete)
+            return Response("Successfully updated/ En cours de réparation")
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
     @swagger_auto_schema(method='GET',
                          operation_id='List Strava activities',
-                         operation_description="Retrieve athlete's Strava activities",
+                         operation_description="Retrieve athlete's Strava activities, as synchronized in the "
+                                               "background.",
+                         responses={200: StravaActivitySerializer(many=True)},
                          tags=tags)
     @action(detail=True, methods=['GET'])
     def strava_activities(self, request, pk=None):
+        if not pk.isdigit() or not Athlete.objects.filter(id=pk).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Athlete {pk} not found"})
+        page = self.paginate_queryset(StravaActivity.objects.filter(athlete_id=pk))
+        return self.get_paginated_response(StravaActivitySerializer(page, many=True).data)
 
-        user_id = request.user.id
-        try:
-            athlete = Athlete.objects.get(user__id=user_id)
-        except models.ObjectDoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f'Athlete {user_id} not found.'})
-        if time.time() > athlete.last_update.time():
-            if time.time() > athlete.access_token_expiration_date:
-                refresh_strava_token(athlete)
-            headers = {'Authorization': 'Bearer ' + athlete.access_token}
-            try:
-                params = {
-                    "per_page": 30,
-                    "before": 1619179200,
-                    "after": 1618401600,
-                }
-                response = requests.get(
-                    url="https://www.strava.com/api/v3/athlete/activities",
-                    headers=headers,
-                    params=params
-                )
-                if response.status_code == 200:
-                    athlete.last_update = now()
-                    activities = response.json()
-                    for activity in activities:
-                        StravaActivity.objects.create(
-                            id=activity.get("id"),
-                            name=activity.get("name"),
-                            type=activity.get("type"),
-                            distance=activity.get("distance"),
-                            moving_time=activity.get("moving_time"),
-                            total_elevation_gain=activity.get(
-                                "total_elevation_gain"),
-                            start_date=datetime.datetime.strptime(activity.get("start_date_local"),
-                                                                  "%Y-%m-%dT%H:%M:%SZ"),
-                            athlete=athlete
-                        )
-            except models.ObjectDoesNotExist:
+    @swagger_auto_schema(method='GET',
+                         operation_id='Get activity feed',
+                         operation_description="Retrieve athlete's scored activities, least recently changed first. "
+                                               "Polling with the `since` token of the previous response only returns "
+                                               "the activities uploaded, changed, rescored or deleted since, or 304 "
+                                               "when there are none. Deleted activities only have their id and "
+                                               "`deleted` set.",
+                         query_serializer=ActivityFeedQuerySerializer,
+                         responses={200: ActivityFeedSerializer(many=True), 304: "No new activity"},
+                         tags=tags)
+    @action(detail=True, methods=['GET'])
+    def activities(self, request, pk=None):
+        if not pk.isdigit():
+            return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Athlete {pk} not found"})
+        paginator = ActivityFeedPagination()
+        page = paginator.paginate_queryset(Activity.objects.filter(athlete_id=pk), request, self,
+                                           deletions=ActivityDeletion.objects.filter(athlete_id=pk))
+        if not page:
+            if paginator.since is not None:
+                return Response(status=status.HTTP_304_NOT_MODIFIED)
+            if not Athlete.objects.filter(id=pk).exists():
                 return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Athlete {pk} not found"})
-        return Response("Todo")
+        return paginator.get_paginated_response([
+            (ActivityFeedSerializer if isinstance(row, Activity) else ActivityDeletionSerializer)(row).data
+            for row in page
+        ])
 
 
 class TeamViewSet(mixins.ListModelMixin,
@@ -294,6 +337,15 @@ class TeamViewSet(mixins.ListModelMixin,
     permission_classes = [IsAuthenticated]
     tags = ["Teams"]
 
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve', 'members', 'admin', 'join'):
+            members = Athlete.objects.select_related('user')
+            return self.queryset.select_related('race', 'category').prefetch_related(
+                Prefetch('members', queryset=members),
+                Prefetch('admins', queryset=members)
+            )
+        return self.queryset
+
     @swagger_auto_schema(operation_id='List teams',
                          operation_description='Retrieve the list of all the teams registered',
                          tags=tags)
@@ -317,7 +369,7 @@ class TeamViewSet(mixins.ListModelMixin,
         category_id = request.POST.get("category_id")
         if user_id and name and join_code and race_id:
             try:
-                athlete = Athlete.objects.get(user__id=user_id)
+                athlete = Athlete.objects.get(id=get_athlete_id(request))
                 if athlete.team is None:
                     race = Race.objects.get(id=race_id)
                     category = Category.objects.get(id=category_id)
@@ -334,7 +386,7 @@ class TeamViewSet(mixins.ListModelMixin,
                     return Response(TeamSerializer(team).data)
                 return Response(status=status.HTTP_400_BAD_REQUEST,
                                 data={'err': "This athlete is already member of a team"})
-            except models.ObjectDoesNotExist as e:
+            except ObjectDoesNotExist as e:
                 print(e)
                 return Response(status=status.HTTP_404_NOT_FOUND, data={'err': "Error w/ parameters received"})
         else:
@@ -344,17 +396,12 @@ class TeamViewSet(mixins.ListModelMixin,
                          operation_description='Delete a team',
                          tags=tags)
     def destroy(self, request, *args, **kwargs):
-        user_id = request.user.id
-        try:
-            athlete = Athlete.objects.get(user__id=user_id)
-            team = Team.objects.get(id=int(kwargs["pk"]))
-            if athlete.admin is not None:
-                if athlete.admin.id == team.id:
-                    team.delete()
-                    return Response(TeamLightSerializer(Team.objects.all(), many=True).data)
-            return Response("Athlete is not admin of this team")
-        except models.ObjectDoesNotExist:
+        deleted, _ = Team.objects.filter(id=kwargs["pk"], id__in=administered_by(get_athlete_id(request))).delete()
+        if deleted:
+            return Response(TeamLightSerializer(Team.objects.all(), many=True).data)
+        if not Team.objects.filter(id=kwargs["pk"]).exists():
             return Response("Error")
+        return Response("Athlete is not admin of this team")
 
     @swagger_auto_schema(method='PUT',
                          operation_id='Update join code',
@@ -362,27 +409,46 @@ class TeamViewSet(mixins.ListModelMixin,
                          tags=tags)
     @action(detail=True, methods=['PUT'])
     def join_codes(self, request, pk=None):
-        user_id = request.user.id
-        try:
-            team = Team.objects.get(id=pk)
-        except models.ObjectDoesNotExist:
+        join_code = request.POST.get("join_code")
+        if not join_code:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'err': "Missing join code"})
+        if Team.objects.filter(id=pk, id__in=administered_by(get_athlete_id(request))).update(join_code=join_code):
+            return Response("Join code successfully updated")
+        if not Team.objects.filter(id=pk).exists():
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Team {pk} not found."})
-        try:
-            athlete = Athlete.objects.get(user__id=user_id)
-        except models.ObjectDoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND,
-                            data={'err': f"Athlete with id {request.POST.get('racer_id')} not found"})
-        if athlete.admin is not None:
-            if athlete.admin.id == team.id:
-                team.join_code = request.POST.get("join_code")
-                team.save()
-                return Response("Join code successfully updated")
-            else:
-                return Response(status=status.HTTP_400_BAD_REQUEST,
-                                data={'err': f"Athlete with id {athlete.id} does not have enough rights."})
         return Response(status=status.HTTP_403_FORBIDDEN,
                         data={'err': "Athlete must be an admin of the team to change join code"})
 
+    @swagger_auto_schema(method='GET',
+                         operation_id='Get team picture',
+                         operation_description="Retrieve the picture of a team and its thumbnails.",
+                         responses={200: PictureSerializer},
+                         tags=tags)
+    @swagger_auto_schema(method='POST',
+                         operation_id='Create team picture',
+                         operation_description="Allow a team's admin to upload the picture of the team. Its "
+                                               "thumbnails are generated in the background.",
+                         request_body=no_body,
+                         manual_parameters=[openapi.Parameter('picture', openapi.IN_FORM,
+                                                              type=openapi.TYPE_FILE, required=True)],
+                         responses={200: PictureSerializer},
+                         tags=tags)
+    @action(detail=True, methods=['GET', 'POST'], parser_classes=[MultiPartParser])
+    def pictures(self, request, pk=None):
+        try:
+            team = Team.objects.only('id', 'image', 'thumbnail', 'thumbnail_jpeg').get(id=pk)
+        except ObjectDoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Team with id {pk} not found."})
+        if request.method == "POST":
+            if not Athlete.objects.filter(id=get_athlete_id(request), admin_id=team.id).exists():
+                return Response(status=status.HTTP_403_FORBIDDEN,
+                                data={'err': "Athlete must be an admin of the team to change its picture"})
+            upload = PictureSerializer(data={'picture': request.FILES.get("picture")})
+            if not upload.is_valid():
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'err': upload.errors['picture']})
+            images.replace_picture(team, upload.validated_data['picture'])
+        return Response(PictureSerializer(team, context={'request': request}).data)
+
     @swagger_auto_schema(method='GET',
                          operation_id='Get members',
                          operation_description="Retrieve team's members",
@@ -393,26 +459,23 @@ class TeamViewSet(mixins.ListModelMixin,
                          tags=tags)
     @action(detail=True, methods=['GET', 'DELETE'])
     def members(self, request, pk=None):
+        if request.method == "DELETE":
+            admin_id = get_athlete_id(request)
+            with transaction.atomic():
+                try:
+                    athlete = Athlete.objects.select_for_update().get(id=request.POST.get("athlete_id"))
+                except (ValueError, ObjectDoesNotExist):
+                    return Response(status=status.HTTP_404_NOT_FOUND,
+                                    data={'err': f"Racer with id {request.POST.get('athlete_id')} not found."})
+                if athlete.id != admin_id and athlete.admin_id is None and str(athlete.team_id) == pk \
+                        and Team.objects.filter(id=pk, id__in=administered_by(admin_id)).exists():
+                    lock_teams(athlete.team_id)
+                    athlete.team = None
+                    athlete.save(update_fields=['team'])
         try:
-            team = Team.objects.get(id=pk)
-        except models.ObjectDoesNotExist:
+            team = self.get_queryset().get(id=pk)
+        except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Team with id {pk} not found."})
-        if request.method == "DELETE":
-            user_id = request.user.id
-            try:
-                admin = Athlete.objects.get(user__id=user_id)
-                athlete = Athlete.objects.get(
-                    id=request.POST.get("athlete_id"))
-            except models.ObjectDoesNotExist:
-                return Response(status=status.HTTP_404_NOT_FOUND,
-                                data={'err': f"Racer with id {request.POST.get('racer_id')} not found."})
-            if athlete != admin:
-                if admin.admin is not None:
-                    if admin.admin.id == team.id:
-                        if athlete.team is not None and athlete.admin is None:
-                            if athlete.team.id == team.id:
-                                athlete.team = None
-                                athlete.save()
         return Response(TeamSerializer(team).data)
 
     @swagger_auto_schema(method='POST',
@@ -421,70 +484,65 @@ class TeamViewSet(mixins.ListModelMixin,
                          tags=tags)
     @action(detail=True, methods=['POST'])
     def join(self, request, pk=None):
-        user_id = request.user.id
         try:
-            team = Team.objects.get(id=pk)
-        except models.ObjectDoesNotExist:
+            team_id = int(pk)
+        except ValueError:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Team with id {pk} not found"})
         join_code = request.POST.get("join_code")
-        try:
-            athlete = Athlete.objects.get(user__id=user_id)
-        except models.ObjectDoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Racer with id {user_id} not found"})
-        if join_code == team.join_code:
-            if team.members.count() < team.category.nb_participants:
-                if athlete.team is not None:
-                    if not athlete.team.id == team.id:
-                        athlete.team = team
-                        athlete.save()
-                        return Response(TeamSerializer(team).data)
-                    else:
-                        return Response(status=status.HTTP_400_BAD_REQUEST, data={
-                            'err': f"Racer with id {user_id} is already a member of the team {team.id}"})
-                else:
-                    athlete.team = team
-                    athlete.save()
-                    return Response(TeamSerializer(team).data)
-            else:
+        with transaction.atomic():
+            try:
+                athlete = Athlete.objects.select_for_update().get(id=get_athlete_id(request))
+            except ObjectDoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND,
+                                data={'err': f"Racer with id {request.user.id} not found"})
+            teams = lock_teams(team_id, athlete.team_id)
+            if team_id not in teams:
+                return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Team with id {pk} not found"})
+            team = teams[team_id]
+            if join_code != team.join_code:
+                return Response(status=status.HTTP_403_FORBIDDEN, data={'err': "Wrong join code"})
+            if athlete.team_id == team.id:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={
+                    'err': f"Racer with id {athlete.id} is already a member of the team {team.id}"})
+            if team.members.count() >= team.category.max_participants:
                 return Response(status=status.HTTP_400_BAD_REQUEST,
                                 data={'err': f"The team with id {team.id} has already reach its maximal capacity"})
-        else:
-            return Response(status=status.HTTP_403_FORBIDDEN, data={'err': "Wrong join code"})
+            athlete.team = team
+            athlete.save()
+        return Response(TeamSerializer(self.get_queryset().get(id=team.id)).data)
 
     @swagger_auto_schema(method='POST',
                          operation_id='Leave team',
                          operation_description="Allow an athlete to leave a team by him/herself. If the athlete leaving"
-                                               "is the only admin of the team, the admin role is transferred to a "
-                                               "random member of the team.",
+                                               "is the only admin of the team, the admin role is transferred to "
+                                               "another member of the team. The team is deleted when its last member "
+                                               "leaves.",
                          tags=tags)
     @action(detail=True, methods=["POST"])
     def leave(self, request, pk=None):
-        user_id = request.user.id
         try:
-            athlete = Athlete.objects.get(user__id=user_id)
-            team = Team.objects.get(id=pk)
-            if athlete.team is not None:
-                if athlete.team.id == team.id:
-                    if athlete.admin is not None:
-                        if athlete.admin.id == team.id:
-                            if team.admins.count() == 1 and team.members.count() >= 2:
-                                members = team.members.all()
-                                for member in members:
-                                    if member != athlete:
-                                        member.admin = team
-                                        member.save()
-                                        break
-                            elif team.admins.count() == 0 and team.members.count() == 1:
-                                team.delete()
-                    athlete.team = None
-                    athlete.admin = None
-                    athlete.save()
-                    return Response("Athlete leaves the team successfully.")
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        except models.ObjectDoesNotExist as e:
-            print(e)
+            team_id = int(pk)
+        except ValueError:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': "Team or athlete not found."})
+        with transaction.atomic():
+            try:
+                athlete = Athlete.objects.select_for_update().get(id=get_athlete_id(request))
+            except ObjectDoesNotExist:
+                return Response(status=status.HTTP_404_NOT_FOUND, data={'err': "Team or athlete not found."})
+            team = lock_teams(athlete.team_id).get(athlete.team_id)
+            if team is None or team.id != team_id:
+                if not Team.objects.filter(id=team_id).exists():
+                    return Response(status=status.HTTP_404_NOT_FOUND, data={'err': "Team or athlete not found."})
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            others = list(team.members.exclude(id=athlete.id).order_by('id').values_list('id', 'admin_id'))
+            if others and athlete.admin_id == team.id and all(admin_id != team.id for _, admin_id in others):
+                Athlete.objects.filter(id=others[0][0]).update(admin=team)
+            athlete.team = None
+            athlete.admin = None
+            athlete.save()
+            if not others:
+                team.delete()
+        return Response("Athlete leaves the team successfully.")
 
     @swagger_auto_schema(method='GET',
                          operation_id="List team admins",
@@ -500,38 +558,119 @@ class TeamViewSet(mixins.ListModelMixin,
                          tags=tags)
     @action(detail=True, methods=["GET", "POST", "DELETE"])
     def admin(self, request, pk=None):
-        user_id = request.user.id
         try:
             team = Team.objects.get(id=pk)
-        except models.ObjectDoesNotExist:
+        except ObjectDoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Team with id {pk} not found."})
-        try:
-            admin = Athlete.objects.get(user__id=user_id)
-            athlete = Athlete.objects.get(
-                id=int(request.POST.get("athlete_id")))
-            if admin.admin is not None:
+        if request.method != 'GET':
+            with transaction.atomic():
+                try:
+                    athlete = Athlete.objects.select_for_update().get(id=int(request.POST.get("athlete_id")))
+                except (TypeError, ValueError, ObjectDoesNotExist):
+                    return Response(status=status.HTTP_404_NOT_FOUND,
+                                    data={'err': f"Racer with id {request.POST.get('athlete_id')} not found."})
+                if not Athlete.objects.filter(id=get_athlete_id(request), admin=team).exists():
+                    return Response(status=status.HTTP_403_FORBIDDEN,
+                                    data={'err': "Athlete must be an admin of the team"})
                 if request.method == 'POST':
-                    if athlete.team.id == team.id and admin.admin.id == team.id:
-                        athlete.admin = team
-                        athlete.save()
-                    else:
+                    if athlete.team_id != team.id:
                         return Response(status=status.HTTP_400_BAD_REQUEST, data={
                             'err': f"Racer with id {athlete.id} cannot be an admin: he/she is not a member of"
                                    f" the team"})
-
+                    athlete.admin = team
+                    athlete.save(update_fields=['admin'])
                 if request.method == 'DELETE':
-                    if athlete.admin.id == team.id and admin.admin.id == team.id:
-                        if team.admins.count() > 1:
-                            athlete.admin = None
-                            athlete.save()
-                        else:
-                            return Response(status=status.HTTP_400_BAD_REQUEST,
-                                            data={'err': "A team must have an administrator"})
-                    else:
+                    if athlete.admin_id != team.id:
                         return Response(status=status.HTTP_400_BAD_REQUEST)
-                return Response(TeamSerializer(team).data)
-        except models.ObjectDoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND, data={'err': f"Racer with id {request.POST.get('id')}"})
+                    if team.admins.count() <= 1:
+                        return Response(status=status.HTTP_400_BAD_REQUEST,
+                                        data={'err': "A team must have an administrator"})
+                    athlete.admin = None
+                    athlete.save(update_fields=['admin'])
+        return Response(TeamSerializer(self.get_queryset().get(id=team.id)).data)
+
+
+class RankingViewSet(viewsets.GenericViewSet):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    pagination_class = RankingPagination
+    tags = ['Rankings']
+
+    def get_filters(self):
+        query = RankingQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        return query.validated_data
+
+    @staticmethod
+    def snapshot_key(ranking, query_params):
+        """
+        Key of a ranking page snapshot, built from the validated filters and the decoded cursor.
+
+        Raises ValidationError or NotFound for invalid queries, which are never cached.
+        """
+        query = RankingQuerySerializer(data=query_params)
+        query.is_valid(raise_exception=True)
+        params = dict(query.validated_data)
+        params['cursor'] = RankingPagination.parse_cursor(params.get('cursor'))
+        return snapshot_key('rankings', ranking, params)
+
+    def get_snapshot(self, compute):
+        key = self.snapshot_key(self.action, self.request.query_params)
+        return Response(snapshot(key, compute, settings.RANKING_SNAPSHOT_TTL, 'rankings'))
+
+    @staticmethod
+    def athletes_queryset(filters):
+        queryset = Athlete.objects.select_related('user').annotate(total=F('points'))
+        for field in ('race', 'category', 'gender'):
+            if field in filters:
+                queryset = queryset.filter(**{field: filters[field]})
+        return queryset
+
+    @staticmethod
+    def teams_queryset(filters):
+        queryset = Team.objects.select_related('race', 'category')
+        if 'gender' in filters:
+            # Only the members of the gender count: sum them instead of using the team total.
+            queryset = queryset.annotate(total=Coalesce(Sum('members__points',
+                                                            filter=Q(members__gender=filters['gender'])),
+                                                        Value(0.0), output_field=FloatField()))
+        else:
+            queryset = queryset.annotate(total=F('points'))
+        for field in ('race', 'category'):
+            if field in filters:
+                queryset = queryset.filter(**{field: filters[field]})
+        return queryset
+
+    def rank_athletes(self):
+        page = self.paginate_queryset(self.athletes_queryset(self.get_filters()))
+        return self.get_paginated_response(AthleteRankingSerializer(page, many=True).data).data
+
+    def rank_teams(self):
+        page = self.paginate_queryset(self.teams_queryset(self.get_filters()))
+        return self.get_paginated_response(TeamRankingSerializer(page, many=True).data).data
+
+    @swagger_auto_schema(method='GET',
+                         operation_id='Rank athletes',
+                         operation_description='Retrieve the athletes standings, best first.',
+                         query_serializer=RankingQuerySerializer,
+                         responses={200: AthleteRankingSerializer(many=True)},
+                         tags=tags,
+                         security=[])
+    @action(detail=False, methods=['GET'])
+    def athletes(self, request):
+        return self.get_snapshot(self.rank_athletes)
+
+    @swagger_auto_schema(method='GET',
+                         operation_id='Rank teams',
+                         operation_description="Retrieve the teams standings, best first. When a gender is given, only "
+                                               "the points of the team's members of this gender are counted.",
+                         query_serializer=RankingQuerySerializer,
+                         responses={200: TeamRankingSerializer(many=True)},
+                         tags=tags,
+                         security=[])
+    @action(detail=False, methods=['GET'])
+    def teams(self, request):
+        return self.get_snapshot(self.rank_teams)
 
 
 @swagger_auto_schema(method='POST',
@@ -546,9 +685,9 @@ def access_token(request):
     if request.method == 'POST':
         user = authenticate(username=username, password=password)
         if user:
-            if Athlete.objects.filter(user=user).exists():
-                athlete = Athlete.objects.get(user=user)
-                refresh = RefreshToken.for_user(user)
+            athlete = Athlete.objects.filter(user=user).first()
+            if athlete is not None:
+                refresh = CustomTokenObtainPairSerializer.get_token(user, athlete)
                 return Response(
                     {
                         "id": athlete.id,
@@ -568,7 +707,11 @@ def access_token(request):
 def refresh_tocken(request):
     refresh = request.POST.get("refresh")
     if refresh:
-        refresh_token = RefreshToken(refresh)
+        try:
+            refresh_token = RefreshToken(refresh)
+        except TokenError:
+            return Response(status=status.HTTP_401_UNAUTHORIZED, data={'err': "Invalid refresh token"})
+        set_athlete_claims(refresh_token, Athlete.objects.filter(user__id=refresh_token['user_id']).first())
         return Response(
             {
                 "access": str(refresh_token.access_token),
@@ -578,22 +721,57 @@ def refresh_tocken(request):
     return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
-def refresh_strava_token(athlete: Athlete):
-    data = {
-        "client_id": os.getenv("CLIENT_ID"),
-        "client_secret": os.getenv("CLIENT_SECRET"),
-        "grant": "refresh_token",
-        "refresh": athlete.refresh_token
-    }
-    response = requests.get(
-        url="https://www.strava.com/api/v3/oauth/token",
-        data=data
-    )
-    if response.status_code == 200:
-        data = response.json()
-        athlete.access_token = data.get("access_token")
-        athlete.access_token_expiration_date = datetime.datetime.fromtimestamp(
-            data.get("expires_at"))
-        athlete.refresh_token = data.get("refresh_token")
-        athlete.strava_id = data.get("athlete").get("id")
-        athlete.save()
+@swagger_auto_schema(method='GET',
+                     operation_id='Validate Strava subscription',
+                     operation_description="Answer Strava's challenge when creating the webhook subscription.",
+                     tags=['Strava'],
+                     security=[])
+@swagger_auto_schema(method='POST',
+                     operation_id='Receive Strava event',
+                     operation_description="Receive a Strava webhook event: activities created, updated or deleted "
+                                           "and athletes deauthorizing the application are queued for the worker, "
+                                           "which checks them against the Strava API.",
+                     request_body=StravaEventSerializer,
+                     tags=['Strava'],
+                     security=[])
+@api_view(['GET', 'POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def strava_webhook(request):
+    if request.method == 'GET':
+        verify_token = settings.STRAVA_WEBHOOK_VERIFY_TOKEN
+        if verify_token and request.query_params.get("hub.mode") == "subscribe" \
+                and request.query_params.get("hub.verify_token") == verify_token:
+            return Response({"hub.challenge": request.query_params.get("hub.challenge")})
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    if not settings.STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+        return Response(status=status.HTTP_403_FORBIDDEN, data={'err': "No Strava webhook subscription"})
+    event = StravaEventSerializer(data=request.data)
+    if not event.is_valid():
+        return Response(status=status.HTTP_400_BAD_REQUEST, data={'err': event.errors})
+    from . import sync
+    sync.enqueue_event(event.validated_data)
+    return Response(status=status.HTTP_200_OK)
+
+
+@swagger_auto_schema(method='GET',
+                     operation_id='Export results',
+                     operation_description="Download the results of every athlete, with his/her points per "
+                                           "discipline. Reserved to the organizers.",
+                     query_serializer=ExportQuerySerializer,
+                     tags=['Results'])
+@api_view(['GET'])
+@permission_classes([IsStaff])
+def export_results(request):
+    query = ExportQuerySerializer(data=request.query_params)
+    query.is_valid(raise_exception=True)
+    output = query.validated_data['output']
+    lines = export.stream_results(output, query.validated_data.get('race'))
+    if isinstance(request._request, ASGIRequest):
+        # Django iterates streaming responses in the event loop under ASGI, where the export queries cannot run:
+        # the file is built here, in the view's thread.
+        response = HttpResponse(''.join(lines), content_type=export.CONTENT_TYPES[output])
+    else:
+        response = StreamingHttpResponse(lines, content_type=export.CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="results.{output}"'
+    return response
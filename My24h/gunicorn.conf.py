@@ -0,0 +1,47 @@
+import multiprocessing
+import os
+
+# "wsgi" serves the application with gunicorn sync workers, one request at a time per process. "asgi" serves it with
+# uvicorn workers: each process handles many concurrent requests, the blocking views running in threads.
+server_mode = os.getenv("SERVER_MODE", default="wsgi")
+
+if server_mode == "asgi":
+    wsgi_app = "My24h.asgi:application"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    workers = int(os.getenv("WEB_CONCURRENCY", default=multiprocessing.cpu_count()))
+else:
+    wsgi_app = "My24h.wsgi:application"
+    worker_class = "sync"
+    workers = int(os.getenv("WEB_CONCURRENCY", default=multiprocessing.cpu_count() * 2 + 1))
+
+bind = os.getenv("GUNICORN_BIND", default="0.0.0.0:8000")
+
+# Startup profile: with STARTUP_PROFILE_DIR set, each worker writes to <dir>/worker-<pid>.txt the time and peak memory
+# it took to load the application and its URLs. Also set PYTHONPROFILEIMPORTTIME=1 in the environment of gunicorn to
+# get the -X importtime breakdown of the modules each worker imported.
+startup_profile_dir = os.getenv("STARTUP_PROFILE_DIR")
+
+if startup_profile_dir:
+    import resource
+    import sys
+    import time
+
+    def post_fork(server, worker):
+        worker.profile_start = time.perf_counter()
+        worker.profile_stderr = os.dup(2)
+        sys.stderr.flush()
+        profile = os.open(os.path.join(startup_profile_dir, f"worker-{worker.pid}.txt"),
+                          os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(profile, 2)
+        os.close(profile)
+
+    def post_worker_init(worker):
+        # Django loads the URLs, hence the views, on the first request: load them now to profile them too.
+        from django.urls import get_resolver
+        get_resolver().url_patterns
+        sys.stderr.flush()
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        os.write(2, f"worker {worker.pid}: started in {time.perf_counter() - worker.profile_start:.3f}s, "
+                    f"max RSS {max_rss:.1f} MiB\n".encode())
+        os.dup2(worker.profile_stderr, 2)
+        os.close(worker.profile_stderr)